@@ -1,16 +1,17 @@
 import sys
 import os
-import numpy as np
-import csv  
-import matplotlib.pyplot as plt
+import random
+from collections import deque
+from multiprocessing import freeze_support
 from datetime import datetime
-from scipy.interpolate import interp1d
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QLabel, QPushButton, 
                              QVBoxLayout, QHBoxLayout, QWidget, QFrame, 
                              QGraphicsDropShadowEffect, QProgressBar, 
-                             QFileDialog, QDoubleSpinBox, QSpinBox, QTextEdit, QMessageBox, QSplashScreen)
-from PyQt6.QtCore import Qt, QThread, QObject, pyqtSignal, QUrl
+                             QFileDialog, QDoubleSpinBox, QSpinBox, QTextEdit, QMessageBox, QSplashScreen,
+                             QComboBox, QCheckBox)
+from PyQt6.QtCore import Qt, QThread, QObject, QTimer, pyqtSignal, QUrl
 from PyQt6.QtGui import QColor, QDesktopServices, QIcon
+from mist_render import PLOT_MODES
 
 def resource_path(relative_path):
     try:        
@@ -31,14 +32,14 @@ FONT_FAMILY = "'Segoe UI', 'Verdana', sans-serif"
 FONT_HUD = "'Consolas', 'Courier New', monospace"
 STYLE_SHEET = f"""
     QMainWindow {{ background-color: {COLOR_BG}; }}
-    QLabel {{ color: {COLOR_TEXT_SEC}; font-family: {FONT_FAMILY}; font-size: 11px; font-weight: bold; letter-spacing: 1px; }}
+    QLabel, QCheckBox {{ color: {COLOR_TEXT_SEC}; font-family: {FONT_FAMILY}; font-size: 11px; font-weight: bold; letter-spacing: 1px; }}
     QLabel[class="PanelHeader"] {{ color: {ACCENT_GLOW}; font-size: 10px; letter-spacing: 2px; margin-bottom: 5px; }}
-    QDoubleSpinBox, QSpinBox {{
+    QDoubleSpinBox, QSpinBox, QComboBox {{
         background-color: #101518; color: {COLOR_TEXT_PRI};
         border: 1px solid #37474F; border-radius: 4px; padding: 5px;
         font-family: {FONT_HUD}; font-weight: bold;
     }}
-    QDoubleSpinBox:focus, QSpinBox:focus {{ border: 1px solid {ACCENT_GLOW}; }}
+    QDoubleSpinBox:focus, QSpinBox:focus, QComboBox:focus {{ border: 1px solid {ACCENT_GLOW}; }}
     QProgressBar {{ border: none; border-radius: 3px; background-color: #101518; text-align: center; color: transparent; }}
     QProgressBar::chunk {{ background: {ACCENT_GRADIENT}; border-radius: 3px; }}
     QTextEdit {{
@@ -91,6 +92,15 @@ SUCCESS_BTN_STYLE = """
     }
     QPushButton:hover { background-color: #00E676; color: #000; }
 """
+CANCEL_BTN_STYLE = """
+    QPushButton {
+        background-color: #263238; color: #FF5555;
+        border: 1px solid #FF5555; border-radius: 6px;
+        font-weight: bold; font-size: 12px;
+    }
+    QPushButton:hover { background-color: #FF5555; color: #000; }
+    QPushButton:disabled { color: #546E7A; border: 1px solid #37474F; }
+"""
 # 2. CUSTOM UI COMPONENTS 
 class SectionFrame(QFrame):
     def __init__(self, parent=None):
@@ -102,169 +112,33 @@ class SectionFrame(QFrame):
         shadow.setColor(c); shadow.setOffset(0, 4)
         self.setGraphicsEffect(shadow)
 
-# 3. CALCULATION ENGINE
-class AstroEngine:
-    @staticmethod
-    def analyze_single_event(x, y):
-        x_offset = x[0]; x_c = x - x_offset
-        # Parabolic
-        try:
-            coeffs, cov = np.polyfit(x_c, y, 2, cov=True)
-            a, b, c = coeffs
-            t_par = (-b / (2 * a)) + x_offset
-            var_a, var_b = cov[0,0], cov[1,1]; cov_ab = cov[0,1]
-            sigma_par = np.sqrt(abs((var_b/(4*a**2)) + ((b**2*var_a)/(4*a**4)) - ((2*b*cov_ab)/(4*a**3))))
-            fx = np.linspace(min(x), max(x), 50); fy = a * (fx - x_offset)**2 + b * (fx - x_offset) + c
-        except: t_par, sigma_par, fx, fy = np.nan, 9.999, [], []
-        # KvW
-        try:
-            f_interp = interp1d(x_c, y, kind='linear', fill_value="extrapolate")
-            center = np.mean(x_c); search = (x_c[-1] - x_c[0]) / 3
-            t_trials = np.linspace(center - search, center + search, 50)
-            s_sq = []
-            for t in t_trials:
-                x_ref = 2 * t - x_c
-                mask = (x_ref >= x_c[0]) & (x_ref <= x_c[-1])
-                if np.sum(mask) < 3: s_sq.append(np.inf)
-                else: s_sq.append(np.sum((y[mask] - f_interp(x_ref[mask]))**2))
-            s_sq = np.array(s_sq); valid = np.isfinite(s_sq)
-            if np.sum(valid) > 4:
-                t_c, s_c = t_trials[valid], s_sq[valid]
-                b_idx = np.argmin(s_c); sl = slice(max(0, b_idx-5), min(len(s_c), b_idx+5))
-                A, B, C = np.polyfit(t_c[sl], s_c[sl], 2)
-                if A > 0:
-                    t_kvw = (-B / (2 * A)) + x_offset
-                    sigma_kvw = np.sqrt(2 * abs(C - (B**2)/(4*A)) / (A * (len(x)-2)))
-                else: t_kvw, sigma_kvw = np.nan, 9.999
-            else: t_kvw, sigma_kvw = np.nan, 9.999
-        except: t_kvw, sigma_kvw = np.nan, 9.999
-        return t_kvw, sigma_kvw, t_par, sigma_par, fx, fy
+# 3. ENGINE & WORKER (see mist_core.py)
+def __getattr__(name):
+    # mist.AstroEngine / mist.AnalysisWorker still work, but numpy and the core load on first use, not at startup
+    if name in ('AstroEngine', 'AnalysisWorker'):
+        import mist_core
+        return getattr(mist_core, name)
+    raise AttributeError(f"module 'mist' has no attribute '{name}'")
 
-# 4. WORKER 
-class AnalysisWorker(QObject):
+class QtAnalysisWorker(QObject):
+    # Qt front for mist_core.AnalysisWorker. Log lines and progress are only queued here; the window
+    # drains the queue on a timer, so thousands of minima cost one widget update per tick.
     finished = pyqtSignal(str)
-    progress = pyqtSignal(int)
-    log = pyqtSignal(str, str)    
     def __init__(self, params):
         super().__init__()
-        self.p = params
-        self.engine = AstroEngine()
+        from mist_core import AnalysisWorker
+        self.worker = AnalysisWorker(params)
+        self.queue = deque()    # ('log', msg, color) / ('progress', value); deque appends are thread-safe
+        self.worker.finished.connect(self.finished.emit)
+        self.worker.progress.connect(lambda value: self.queue.append(('progress', value)))
+        self.worker.log.connect(lambda msg, color: self.queue.append(('log', msg, color)))
 
     def run(self):
-        try:
-            fpath = self.p['filepath']
-            folder = os.path.dirname(fpath)
-            base = os.path.basename(fpath).split('.')[0]
-            out_dir = os.path.join(folder, f"{base}_Detailed_Analysis")
-            os.makedirs(out_dir, exist_ok=True)
-            eps_dir = os.path.join(out_dir, "EPS_Figures")
-            os.makedirs(eps_dir, exist_ok=True)            
-            self.log.emit(f"SESSION START: {base}", "#FFFFFF")            
-            try: data = np.loadtxt(fpath)
-            except: data = np.loadtxt(fpath, delimiter=',')
-            bjd, mag, phase = data[:,0], data[:,1], data[:,2]            
-            self.log.emit(f"DATA LOADED: {len(bjd)} ROWS", "#00E676")
-            self.progress.emit(10)
-            
-            header_line = f"{'ID':<15} | {'KvW Time':<15} +/- {'Err':<10} | {'Par Time':<15} +/- {'Err':<10} | {'Status'}"
-            separator = "-" * len(header_line)
-            results = [f"ANALYSIS REPORT: {base}", f"DATE: {datetime.now().strftime('%Y-%m-%d %H:%M')}", "-"*50, header_line, separator]            
-            ml_data = []
-            ranges = [
-                (self.p['p_min'], self.p['p_max'], "Primary"),
-                (self.p['s_min'], self.p['s_max'], "Secondary")
-            ]
-            
-            total_steps = 2
-            current_step = 0
-            
-            for p_min, p_max, lbl in ranges:
-                self.log.emit(f"SCANNING {lbl.upper()}...", "#29B6F6")
-                mask = (phase >= p_min) & (phase <= p_max)
-                x_f, y_f = bjd[mask], mag[mask]
-                
-                if len(x_f) > 0:
-                    sort = np.argsort(x_f)
-                    x_s, y_s = x_f[sort], y_f[sort]
-                    splits = np.where(np.diff(x_s) > 0.3)[0] + 1
-                    cx, cy = np.split(x_s, splits), np.split(y_s, splits)
-                    
-                    valid_cnt = 0
-                    for x_chunk, y_chunk in zip(cx, cy):
-                        if len(x_chunk) < self.p['min_points']: continue
-                        valid_cnt += 1
-                        min_id = f"{lbl}_{valid_cnt}"                        
-                        t_kvw, e_kvw, t_par, e_par, fx, fy = self.engine.analyze_single_event(x_chunk, y_chunk)
-                        
-                        if not np.isnan(t_par):
-                            mc_kvw, mc_par = [], []
-                            x_off = x_chunk[0]
-                            c_poly = np.polyfit(x_chunk - x_off, y_chunk, 2)
-                            resid = y_chunk - np.poly1d(c_poly)(x_chunk - x_off)
-                            noise = np.std(resid)
-                            
-                            for _ in range(self.p['mc_iter']):
-                                y_n = y_chunk + np.random.normal(0, noise, len(y_chunk))
-                                mk, _, mp, _, _, _ = self.engine.analyze_single_event(x_chunk, y_n)
-                                if not np.isnan(mk): mc_kvw.append(mk)
-                                if not np.isnan(mp): mc_par.append(mp)                            
-                            fe_kvw = np.std(mc_kvw) if mc_kvw else e_kvw
-                            fe_par = np.std(mc_par) if mc_par else e_par
-                            status = "CHECK" if abs(t_kvw - t_par) > self.p['threshold'] else "OK"                            
-                            results.append(f"{min_id:<15} | {t_kvw:.5f} +/- {fe_kvw:.5f} | {t_par:.5f} +/- {fe_par:.5f} | {status}")
-                            ml_data.append({'ID': min_id, 'KvW': t_kvw, 'Par': t_par, 'Status': status})
-                            
-                            # DRAW GRAPH
-                            self.plot(x_chunk, y_chunk, fx, fy, t_kvw, min_id, resid, out_dir, eps_dir)
-                            color_log = "#FF5555" if status == "CHECK" else "#90A4AE"
-                            self.log.emit(f"-> {min_id} ({status})", color_log)                            
-                current_step += 1
-                self.progress.emit(10 + int((current_step/total_steps)*80))
+        self.worker.run()
 
-            # REPORT.TXT 
-            with open(os.path.join(out_dir, "Minima_Report.txt"), "w") as f: f.write("\n".join(results))
-            
-            # CSV 
-            if ml_data:
-                csv_path = os.path.join(out_dir, "ML_Data.csv")
-                try:
-                    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-                        writer = csv.DictWriter(f, fieldnames=['ID', 'KvW', 'Par', 'Status'])
-                        writer.writeheader()
-                        writer.writerows(ml_data)
-                except Exception as e:
-                    self.log.emit(f"CSV ERROR: {str(e)}", "#FF5555")            
-            self.progress.emit(100)
-            self.log.emit("ANALYSIS COMPLETED SUCCESSFULLY", "#00E676")
-            self.finished.emit(out_dir)
-        except Exception as e:
-            self.log.emit(f"CRITICAL ERROR: {str(e)}", "#FF0000")
-            self.finished.emit("ERROR")
-
-    def plot(self, x, y, fx, fy, tm, title, res, folder, eps_folder):
-        plt.style.use('default') 
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(8, 6), sharex=True, gridspec_kw={'height_ratios': [3, 1]})
-        
-        # LIGHT CURVE & FIT
-        ax1.plot(x, y, 'ko', alpha=0.7, label='Obs') 
-        if len(fx)>0: ax1.plot(fx, fy, 'r-', lw=2, label='Fit') 
-        if not np.isnan(tm): ax1.axvline(tm, color='blue', ls='--', alpha=0.5)        
-        ax1.set_title(f"{title} (Minima Analysis)", color='black', fontsize=12)
-        ax1.set_ylabel("Magnitude / Flux")
-        ax1.invert_yaxis()
-        ax1.legend()
-        ax1.grid(True, linestyle=':', alpha=0.3)
-        
-        # Residuals 
-        ax2.scatter(x, res, c='black', s=10)
-        ax2.axhline(0, c='red', ls='--') 
-        ax2.set_ylabel("Res.")
-        ax2.set_xlabel("BJD (Time)")
-        ax2.grid(True, linestyle=':', alpha=0.3)        
-        plt.tight_layout()
-        plt.savefig(os.path.join(folder, f"{title}.png"), dpi=150) 
-        plt.savefig(os.path.join(eps_folder, f"{title}.eps"), format='eps')
-        plt.close(fig)
+    def cancel(self):
+        # called from the GUI thread; the worker stops between events and keeps what is finished
+        self.worker.cancel()
 
 # 5. MAIN WINDOW (GUI) 
 class AstroHunterWindow(QMainWindow):
@@ -278,6 +152,9 @@ class AstroHunterWindow(QMainWindow):
         self.filepath = None
         self.worker = None
         self.thread = None
+        self.closing = False    # close requested while an analysis runs: the window closes once it has stopped
+        self.ui_timer = QTimer(self); self.ui_timer.setInterval(100)
+        self.ui_timer.timeout.connect(self.drain_worker)
         self.last_output_dir = None
         container = QWidget(); self.setCentralWidget(container)
         main_layout = QVBoxLayout(container); main_layout.setSpacing(15); main_layout.setContentsMargins(25, 25, 25, 25)
@@ -323,6 +200,10 @@ class AstroHunterWindow(QMainWindow):
         self.sp_smin = self.create_spinner(1.45); row2.addWidget(self.sp_smin)
         self.sp_smax = self.create_spinner(1.55); row2.addWidget(self.sp_smax)
         pp_layout.addLayout(row2)
+        # blind detection: eclipses are found in BJD / mag alone and the phase windows are not used
+        self.chk_detect = QCheckBox("BLIND DETECTION (NO PHASE WINDOWS)")
+        self.chk_detect.toggled.connect(lambda on: [sp.setEnabled(not on) for sp in (self.sp_pmin, self.sp_pmax, self.sp_smin, self.sp_smax)])
+        pp_layout.addWidget(self.chk_detect)
         
         sep = QFrame(); sep.setFixedHeight(1); sep.setStyleSheet("background-color: #37474F; margin: 5px 0;")
         pp_layout.addWidget(sep)
@@ -347,6 +228,36 @@ class AstroHunterWindow(QMainWindow):
         self.sp_threshold.setAlignment(Qt.AlignmentFlag.AlignCenter)
         row3.addWidget(self.sp_threshold)
         pp_layout.addLayout(row3)
+
+        row_kvw = QHBoxLayout()
+        row_kvw.addWidget(QLabel("KvW Trials"))
+        self.sp_trials = QSpinBox(); self.sp_trials.setRange(20, 2000); self.sp_trials.setValue(50); self.sp_trials.setButtonSymbols(QSpinBox.ButtonSymbols.NoButtons)
+        self.sp_trials.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        row_kvw.addWidget(self.sp_trials)
+        # final KvW trial spacing in days of the coarse-to-fine search; 0 = the fixed grid of KvW Trials
+        row_kvw.addWidget(QLabel("KvW Tol"))
+        self.sp_kvw_tol = QDoubleSpinBox(); self.sp_kvw_tol.setRange(0.0, 0.01); self.sp_kvw_tol.setDecimals(4); self.sp_kvw_tol.setSingleStep(0.0001)
+        self.sp_kvw_tol.setValue(0.001); self.sp_kvw_tol.setButtonSymbols(QDoubleSpinBox.ButtonSymbols.NoButtons)
+        self.sp_kvw_tol.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        row_kvw.addWidget(self.sp_kvw_tol)
+        # MC seed of the session: reruns draw the same noise and reuse cached results; reset draws a new one
+        row_kvw.addWidget(QLabel("Seed"))
+        self.sp_seed = QSpinBox(); self.sp_seed.setRange(0, 99_999); self.sp_seed.setValue(random.randrange(100_000)); self.sp_seed.setButtonSymbols(QSpinBox.ButtonSymbols.NoButtons)
+        self.sp_seed.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        row_kvw.addWidget(self.sp_seed)
+        pp_layout.addLayout(row_kvw)
+
+        row4 = QHBoxLayout()
+        # adaptive: MC Iter. becomes a cap, the MC stops once both sigmas have converged
+        self.chk_adaptive = QCheckBox("Adaptive MC"); row4.addWidget(self.chk_adaptive)
+        row4.addWidget(QLabel("Workers"))
+        self.sp_workers = QSpinBox(); self.sp_workers.setRange(1, os.cpu_count() or 1); self.sp_workers.setValue(1); self.sp_workers.setButtonSymbols(QSpinBox.ButtonSymbols.NoButtons)
+        self.sp_workers.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        row4.addWidget(self.sp_workers)
+        row4.addWidget(QLabel("Plots"))
+        self.cb_plots = QComboBox(); self.cb_plots.addItems(PLOT_MODES); self.cb_plots.setCurrentText("check-only")
+        row4.addWidget(self.cb_plots)
+        pp_layout.addLayout(row4)
         main_layout.addWidget(panel_params)
 
         # 9. ACTION
@@ -359,6 +270,12 @@ class AstroHunterWindow(QMainWindow):
         pa_layout.addWidget(self.btn_run)        
         self.pbar = QProgressBar(); self.pbar.setFixedHeight(6)
         pa_layout.addWidget(self.pbar)        
+        self.btn_cancel = QPushButton("■ CANCEL ANALYSIS")
+        self.btn_cancel.setStyleSheet(CANCEL_BTN_STYLE)
+        self.btn_cancel.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.btn_cancel.clicked.connect(self.cancel_analysis)
+        self.btn_cancel.setVisible(False)
+        pa_layout.addWidget(self.btn_cancel)
         self.btn_reset = QPushButton("🔄 RESET SYSTEM")
         self.btn_reset.setStyleSheet(FILE_BTN_STYLE) 
         self.btn_reset.setCursor(Qt.CursorShape.PointingHandCursor)
@@ -413,7 +330,9 @@ class AstroHunterWindow(QMainWindow):
             'p_min': self.sp_pmin.value(), 'p_max': self.sp_pmax.value(),
             's_min': self.sp_smin.value(), 's_max': self.sp_smax.value(),
             'mc_iter': self.sp_mc.value(), 'min_points': self.sp_pts.value(),
-            'threshold': self.sp_threshold.value()
+            'threshold': self.sp_threshold.value(), 'kvw_trials': self.sp_trials.value(), 'kvw_tol': self.sp_kvw_tol.value(),
+            'workers': self.sp_workers.value(), 'plots': self.cb_plots.currentText(),
+            'mc_adaptive': self.chk_adaptive.isChecked(), 'detect': self.chk_detect.isChecked(), 'seed': self.sp_seed.value()
         }
 
         self.btn_run.setEnabled(False); self.btn_run.setText("PROCESSING...")
@@ -421,28 +340,66 @@ class AstroHunterWindow(QMainWindow):
         self.log_box.clear()
         self.pbar.setValue(0)        
         self.thread = QThread()
-        self.worker = AnalysisWorker(params)
+        self.worker = QtAnalysisWorker(params)
         self.worker.moveToThread(self.thread)        
         self.thread.started.connect(self.worker.run)
-        self.worker.progress.connect(self.pbar.setValue)
-        self.worker.log.connect(self.log_to_console)
         self.worker.finished.connect(self.analysis_done)
         self.worker.finished.connect(self.thread.quit)
         self.worker.finished.connect(self.worker.deleteLater)
         self.thread.finished.connect(self.thread.deleteLater)
+        self.btn_cancel.setEnabled(True); self.btn_cancel.setVisible(True)
+        self.ui_timer.start()
         self.thread.start()
+    def drain_worker(self):
+        # everything the worker queued since the last tick: one log append, one progress update
+        if self.worker is None: return
+        lines, value = [], None
+        while self.worker.queue:
+            item = self.worker.queue.popleft()
+            if item[0] == 'log': lines.append(item[1:])
+            else: value = item[1]
+        if lines: self.log_lines(lines)
+        if value is not None: self.pbar.setValue(value)
+    def cancel_analysis(self):
+        if self.worker is None: return
+        self.worker.cancel()
+        self.btn_cancel.setEnabled(False)
+        self.worker.queue.append(('log', "CANCEL REQUESTED: STOPPING AFTER THE CURRENT MINIMUM...", "#FFB74D"))
     def analysis_done(self, result):
+        self.ui_timer.stop(); self.drain_worker()
+        cancelled = self.worker.worker.cancelled
+        self.worker = None
+        self.btn_cancel.setVisible(False)
         self.btn_run.setEnabled(True); self.btn_run.setText("START ANALYSIS")
         if result != "ERROR":
             self.last_output_dir = result
             self.btn_open.setVisible(True)
-            QMessageBox.information(self, "SUCCESS", f"Analysis stored in:\n{result}")
+            if self.closing: pass
+            elif cancelled: QMessageBox.information(self, "CANCELLED", f"Partial results stored in:\n{result}")
+            else: QMessageBox.information(self, "SUCCESS", f"Analysis stored in:\n{result}")
+        if self.closing:
+            # run() has returned; the thread only has to leave its event loop
+            self.thread.quit(); self.thread.wait()
+            self.close()
+    def closeEvent(self, event):
+        # a running analysis is cancelled and the close deferred until its thread has finished;
+        # analysis_done closes the window again
+        if self.worker is not None:
+            if not self.closing:
+                self.closing = True
+                self.cancel_analysis()
+                self.worker.queue.append(('log', "CLOSING ONCE THE ANALYSIS HAS STOPPED...", "#FFB74D"))
+            event.ignore()
+            return
+        super().closeEvent(event)
     def open_output_folder(self):
         if self.last_output_dir and os.path.exists(self.last_output_dir):
             QDesktopServices.openUrl(QUrl.fromLocalFile(self.last_output_dir))
     def log_to_console(self, msg, color="#FFFFFF"):
+        self.log_lines([(msg, color)])
+    def log_lines(self, lines):
         ts = datetime.now().strftime("%H:%M:%S")
-        self.log_box.append(f"<span style='color:#555'>[{ts}]</span> <span style='color:{color}'>{msg}</span>")
+        self.log_box.append("<br>".join(f"<span style='color:#555'>[{ts}]</span> <span style='color:{color}'>{msg}</span>" for msg, color in lines))
     def reset_ui(self):       
         self.filepath = None        
         self.lbl_file_status.setText("NO FILE SELECTED")
@@ -452,7 +409,14 @@ class AstroHunterWindow(QMainWindow):
         self.btn_open.setVisible(False)        
         self.log_to_console("SYSTEM RESET. READY FOR NEW SESSION.", "#00E5FF")
         self.sp_threshold.setValue(0.005)
+        self.sp_trials.setValue(50)
+        self.sp_kvw_tol.setValue(0.001)
+        self.sp_seed.setValue(random.randrange(100_000))
+        self.cb_plots.setCurrentText("check-only")
+        self.chk_adaptive.setChecked(False)
+        self.chk_detect.setChecked(False)
 if __name__ == "__main__":
+    freeze_support()
     import ctypes    
     try:
         myappid = 'mist.v1.astro.hunter'
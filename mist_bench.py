@@ -0,0 +1,225 @@
+# Performance benchmarks for the M.I.S.T pipeline stages on synthetic eclipsing-binary light curves.
+#
+#   python mist_bench.py [--suite quick|full] [--out bench.json] [--compare previous.json] [--tolerance 0.25]
+#
+# Every stage is timed separately (engine fit, Monte Carlo, text loading, cached loading, in-memory,
+# streaming and ephemeris segmentation, blind eclipse detection, figure rendering, whole pipeline,
+# batched O-C fits of many targets) over a grid of points per eclipse,
+# number of eclipses, noise level and mc_iter. Results are written as JSON; with --compare the run is checked against an
+# earlier file and the exit code is 1 when any stage got slower than the tolerance allows.
+# Startup is timed in fresh interpreters (core and CLI import, time to the first GUI window), and the
+# run fails if importing the core or the CLI pulls in Qt or matplotlib, or if the coarse-to-fine KvW
+# search moves any minimum of the shipped example files away from the fixed-grid result.
+import os
+os.environ.setdefault("MPLBACKEND", "Agg")
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+import importlib.util
+import numpy as np
+import mist_core
+from mist_core import (AstroEngine, AnalysisWorker, analyze_event, load_observations, segment_window, stream_segments,
+                       ephemeris_segments, detect_eclipses)
+from mist_render import render_event
+from mist_oc import fit_ephemerides
+
+WINDOWS = [(0.95, 1.05, "Primary"), (1.45, 1.55, "Secondary")]
+HERE = os.path.dirname(os.path.abspath(__file__))
+REFINE_TOL = 0.001       # kvw_tol of the engine.refine cases and the example check
+EXAMPLE_SHIFT = 0.005    # largest allowed refined - grid KvW difference on the example files [days]
+
+# code run in a fresh interpreter; the wall time of the whole process is recorded
+STARTUP = {
+    'startup.python': "pass",
+    'startup.core': "import mist_core",
+    'startup.cli': "import mist_cli",
+    'startup.gui_window': "import sys; from PyQt6.QtWidgets import QApplication; app = QApplication(sys.argv); "
+                          "import mist; w = mist.AstroHunterWindow(); w.show(); app.processEvents()",
+}
+# must not be loaded by importing the core or the CLI
+HEAVY_MODULES = ('PyQt6', 'matplotlib', 'scipy')
+
+SUITES = {
+    # points per primary eclipse window, number of orbital cycles, noise [mag], MC iterations
+    'quick': {'points': [50, 400], 'eclipses': [20], 'noise': [0.005], 'mc_iter': [100]},
+    'full': {'points': [20, 100, 400, 2000], 'eclipses': [20, 200], 'noise': [0.002, 0.02], 'mc_iter': [100, 1000]},
+}
+
+def synthetic_light_curve(n_eclipses=20, points=100, noise=0.005, period=1.5, t0=2460000.0,
+                          depth1=0.8, depth2=0.3, width=0.015, seed=0):
+    # Eclipsing binary with Gaussian-shaped primary (phase 1.0) and secondary (phase 1.5) minima.
+    # The cadence puts `points` observations inside each +/-0.05 primary window. Returns bjd, mag and
+    # phase, with phase folded into [0.8, 1.8) as in the example files.
+    rng = np.random.default_rng(seed)
+    dt = 0.1 * period / points
+    bjd = t0 - 0.5 * period + np.arange(0, n_eclipses * period, dt)
+    cyc = (bjd - t0) / period
+    phase = (cyc - 0.8) % 1 + 0.8
+    d1 = (phase - 1.0); d2 = (phase - 1.5)
+    mag = 10 + depth1 * np.exp(-0.5 * (d1 / width)**2) + depth2 * np.exp(-0.5 * (d2 / width)**2)
+    return bjd, mag + rng.normal(0, noise, len(bjd)), phase
+
+def write_light_curve(path, bjd, mag, phase, delimiter=' '):
+    np.savetxt(path, np.column_stack([bjd, mag, phase]), fmt='%.6f', delimiter=delimiter)
+
+def timeit(fn, repeats=5, min_time=0.2):
+    # Median and best wall time of fn() over `repeats` runs (more when a run is very short)
+    times = []
+    t_end = time.perf_counter() + min_time
+    while len(times) < repeats or (time.perf_counter() < t_end and len(times) < 100):
+        t0 = time.perf_counter(); fn(); times.append(time.perf_counter() - t0)
+    return {'median': float(np.median(times)), 'best': float(np.min(times)), 'runs': len(times)}
+
+def run_python(code):
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    return subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env, check=True, capture_output=True, text=True).stdout
+
+def import_leaks():
+    # {module: [heavy modules it loads]} for the modules that have to stay light
+    code = f"import sys, {{0}}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    leaks = {mod: run_python(code.format(mod)).split() for mod in ('mist_core', 'mist_cli')}
+    return {mod: found for mod, found in leaks.items() if found}
+
+def example_shifts():
+    # {file: (minima, moved by more than EXAMPLE_SHIFT, largest shift [days])} of the refined KvW
+    # against the fixed grid on the example files shipped with the repo. Only grid minima inside the usable
+    # trials, with at least KVW_OVERLAP of the points overlapping their reflection, count; the others are
+    # extrapolated or low-overlap grid results, not real minima.
+    shifts = {}
+    for name in ('example.csv', 'example.txt'):
+        path = os.path.join(HERE, name)
+        if not os.path.exists(path): continue
+        data = load_observations(path, cache=False)
+        segments = [seg for w in WINDOWS for seg in segment_window(data[:,0], data[:,1], data[:,2], *w, 5)]
+        dt = []
+        for _, x, y in segments:
+            t = AstroEngine.analyze_single_event(x, y, 50, 0.0)[0]
+            t_trials, mask = AstroEngine.kvw_grid(x - x[0], 50)[2::2]
+            usable = x[0] + t_trials[mask.sum(axis=1) >= 3]
+            overlap = np.searchsorted(x, 2*t - x[0], 'right') - np.searchsorted(x, 2*t - x[-1], 'left')
+            if len(usable) and usable[0] < t < usable[-1] and overlap >= mist_core.KVW_OVERLAP * len(x):
+                dt.append(AstroEngine.analyze_single_event(x, y, 50, REFINE_TOL)[0] - t)
+        dt = np.abs(np.array(dt))
+        shifts[name] = (len(dt), int(np.sum(~(dt <= EXAMPLE_SHIFT))), float(np.nanmax(dt)) if len(dt) else 0.0)
+    return shifts
+
+def first_segment(bjd, mag, phase):
+    return segment_window(bjd, mag, phase, 0.95, 1.05, "Primary", 5)[0]
+
+def run_suite(suite, work_dir, log=print):
+    grid = SUITES[suite]
+    results = []
+    def record(stage, params, timing):
+        results.append({'stage': stage, 'params': params, **timing})
+        log(f"{stage:<18} {json.dumps(params):<70} {timing['median']*1e3:10.3f} ms")
+
+    for stage, code in STARTUP.items():
+        if stage == 'startup.gui_window' and importlib.util.find_spec("PyQt6") is None: continue
+        record(stage, {}, timeit(lambda: run_python(code), repeats=3, min_time=0))
+
+    for points, noise in itertools.product(grid['points'], grid['noise']):
+        bjd, mag, phase = synthetic_light_curve(3, points, noise)
+        _, x, y = first_segment(bjd, mag, phase)
+        params = {'points': int(len(x)), 'noise': noise}
+        record('engine.single', params, timeit(lambda: AstroEngine.analyze_single_event(x, y, tol=0.0)))
+        record('engine.refine', dict(params, kvw_tol=REFINE_TOL), timeit(lambda: AstroEngine.analyze_single_event(x, y, tol=REFINE_TOL)))
+        for mc_iter in grid['mc_iter']:
+            p = {'mc_iter': mc_iter, 'kvw_trials': 50, 'kvw_tol': 0.0}
+            rng = np.random.default_rng(0)
+            record('engine.mc', dict(params, mc_iter=mc_iter), timeit(lambda: analyze_event(x, y, p, rng), repeats=3))
+            pr = dict(p, kvw_tol=REFINE_TOL)
+            record('engine.mc_refine', dict(params, mc_iter=mc_iter, kvw_tol=REFINE_TOL), timeit(lambda: analyze_event(x, y, pr, rng), repeats=3))
+            pa = dict(p, mc_adaptive=True)
+            record('engine.mc_adaptive', dict(params, mc_iter=mc_iter), timeit(lambda: analyze_event(x, y, pa, rng), repeats=3))
+        res = analyze_event(x, y, {'mc_iter': 10}, np.random.default_rng(0))
+        for fmt, eps in (('png', None), ('png+eps', work_dir)):
+            record('plot', dict(params, plots=fmt),
+                   timeit(lambda: render_event(x, y, res['fx'], res['fy'], res['KvW'], "bench", res['resid'], work_dir, eps), repeats=3))
+
+    for points, n_ecl in itertools.product(grid['points'], grid['eclipses']):
+        bjd, mag, phase = synthetic_light_curve(n_ecl, points, grid['noise'][0])
+        params = {'points': points, 'eclipses': n_ecl, 'rows': int(len(bjd))}
+        path = os.path.join(work_dir, f"lc_{points}_{n_ecl}.txt")
+        write_light_curve(path, bjd, mag, phase)
+        record('io.load_text', params, timeit(lambda: load_observations(path, cache=False), repeats=3))
+        load_observations(path)
+        record('io.load_cached', params, timeit(lambda: np.asarray(load_observations(path)[:, 0]).sum()))
+        record('segment.memory', params, timeit(lambda: [segment_window(bjd, mag, phase, *w, 5) for w in WINDOWS]))
+        record('segment.ephemeris', params, timeit(lambda: ephemeris_segments(bjd, mag, WINDOWS, 2460000.0, 1.5, 0.0, 5)))
+        record('segment.detect', params, timeit(lambda: detect_eclipses(bjd, mag), repeats=3))
+        record('segment.stream', params, timeit(lambda: list(stream_segments(path, WINDOWS, 5)), repeats=3))
+        # whole AnalysisWorker.run without figures or result cache, i.e. what a fresh CLI run costs
+        p = {'filepath': path, 'p_min': 0.95, 'p_max': 1.05, 's_min': 1.45, 's_max': 1.55, 'min_points': 5,
+             'threshold': 0.005, 'mc_iter': grid['mc_iter'][0], 'plots': 'none', 'result_cache': ''}
+        record('pipeline', dict(params, mc_iter=p['mc_iter']), timeit(lambda: AnalysisWorker(p).run(), repeats=1, min_time=0))
+
+    for n_ecl in grid['eclipses']:
+        # 100 targets with n_ecl primary and secondary minima each, all fitted in one call
+        rng = np.random.default_rng(0)
+        group = np.repeat(np.arange(100), 2 * n_ecl); E = np.tile(np.arange(0, n_ecl, 0.5), 100)
+        T = 2460000.0 + 1.5 * E + rng.normal(0, 1e-4, len(E)); e_T = np.full(len(E), 1e-4)
+        for degree in (1, 2):
+            record('oc.fit', {'targets': 100, 'minima': int(len(E)), 'degree': degree},
+                   timeit(lambda: fit_ephemerides(group, E, T, e_T, np.full(100, 2460000.0), np.full(100, 1.5), 0.0, degree)))
+    return results
+
+def environment():
+    try: commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError: commit = ""
+    import matplotlib
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'numpy': np.__version__,
+            'matplotlib': matplotlib.__version__, 'core': mist_core.__file__}
+
+def compare(current, previous, tolerance):
+    # [(stage, params, old, new, ratio)] for every case present in both runs; ratio = new / old median
+    key = lambda r: (r['stage'], json.dumps(r['params'], sort_keys=True))
+    old = {key(r): r for r in previous['results']}
+    rows = []
+    for r in current['results']:
+        o = old.get(key(r))
+        if o: rows.append((r['stage'], r['params'], o['median'], r['median'], r['median'] / max(o['median'], 1e-12)))
+    return rows, [row for row in rows if row[4] > 1 + tolerance]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="M.I.S.T benchmark suite")
+    ap.add_argument("--suite", choices=sorted(SUITES), default='quick')
+    ap.add_argument("--out", default="bench.json", help="JSON file for the results")
+    ap.add_argument("--compare", help="earlier results JSON to check for regressions")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a case counts as a regression")
+    args = ap.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="mist_bench_")
+    try: report = {'suite': args.suite, 'environment': environment(), 'results': run_suite(args.suite, work_dir)}
+    finally: shutil.rmtree(work_dir, ignore_errors=True)
+    report['import_leaks'] = leaks = import_leaks()
+    report['example_shifts'] = shifts = example_shifts()
+    with open(args.out, 'w', encoding='utf-8') as f: json.dump(report, f, indent=2)
+    print(f"\nRESULTS WRITTEN: {args.out}")
+    for mod, found in leaks.items(): print(f"IMPORT REGRESSION: importing {mod} loads {', '.join(found)}")
+    moved = {name: s for name, s in shifts.items() if s[1]}
+    for name, (n, n_moved, worst) in shifts.items():
+        print(f"KVW REFINE CHECK {name}: {n_moved}/{n} MINIMA MOVED > {EXAMPLE_SHIFT} d (MAX {worst:.5f} d)"
+              + ("  <-- REGRESSION" if n_moved else ""))
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f: previous = json.load(f)
+        rows, slow = compare(report, previous, args.tolerance)
+        print(f"\nCOMPARED WITH {args.compare} ({previous['environment'].get('commit') or 'unknown commit'}): {len(rows)} CASES")
+        for stage, params, old, new, ratio in rows:
+            flag = "  <-- REGRESSION" if ratio > 1 + args.tolerance else ""
+            print(f"{stage:<18} {json.dumps(params):<70} {old*1e3:10.3f} -> {new*1e3:10.3f} ms  x{ratio:5.2f}{flag}")
+        if slow:
+            print(f"\n{len(slow)} REGRESSION(S) ABOVE {args.tolerance:.0%}")
+            return 1
+    return 1 if leaks or moved else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# Persistent, content-addressed store of per-event analysis results.
+# An entry holds everything that does not depend on the OK/CHECK threshold (times, MC sigmas,
+# fit curve, residuals), keyed by a hash of the segment data and the parameters that change them,
+# so reruns and reclassifications skip the fits and the Monte Carlo.
+import os
+import hashlib
+import numpy as np
+
+# bump when a change to AstroEngine or the MC procedure alters results, to retire old entries
+METHOD_VERSION = 6
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".mist_cache", "results")
+RESULT_KEYS = ('KvW', 'e_KvW', 'Par', 'e_Par', 'fx', 'fy', 'resid', 'mc_n')
+
+class ResultCache:
+    # One .npz per entry under `folder`; a hit refreshes its mtime and evict() drops the least
+    # recently used entries once the folder exceeds max_mb. Safe to share between processes.
+    def __init__(self, folder=DEFAULT_DIR, max_mb=256):
+        self.folder = folder
+        self.max_bytes = int(max_mb * 1024**2)
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def key(x, y, min_id, p):
+        # the MC noise is drawn from event_rng(seed, min_id), so the ID is part of the key
+        h = hashlib.sha256()
+        h.update(np.ascontiguousarray(x, dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+        h.update(repr((METHOD_VERSION, min_id, p['mc_iter'], p.get('kvw_trials', 50), p.get('seed'),
+                       p.get('mc_adaptive', False), p.get('mc_tol', 0.05), p.get('kvw_tol'))).encode())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        # Cached result dict, {} for a cached failure, or None on a miss
+        path = self.path(key)
+        try:
+            with np.load(path) as z:
+                res = {} if 'failed' in z.files else {k: z[k] for k in RESULT_KEYS}
+            os.utime(path)
+        except (OSError, ValueError, KeyError): return None
+        for k in ('KvW', 'e_KvW', 'Par', 'e_Par'):
+            if k in res: res[k] = float(res[k])
+        return res
+
+    def put(self, key, res):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                if res is None: np.savez(f, failed=True)
+                else: np.savez(f, **{k: res[k] for k in RESULT_KEYS})
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp): os.remove(tmp)
+
+    def evict(self):
+        # Removes least recently used entries until the cache fits max_bytes; returns the count removed
+        entries = []
+        for root, _, names in os.walk(self.folder):
+            for n in names:
+                if not n.endswith('.npz'): continue
+                try: st = os.stat(os.path.join(root, n))
+                except OSError: continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(root, n)))
+        total, removed = sum(e[1] for e in entries), 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes: break
+            try: os.remove(path); total -= size; removed += 1
+            except OSError: pass
+        return removed
@@ -0,0 +1,156 @@
+# Headless batch front end: runs the AnalysisWorker pipeline over files, globs or directories.
+# Only mist_core is imported, so PyQt6 is never loaded and no display is needed.
+#
+#   python mist_cli.py DATA [DATA ...] [--params params.json] [--jobs N] [-v] [--watch SECONDS]
+#
+# params.json holds any of the GUI settings, e.g.
+#   {"p_min": 0.95, "p_max": 1.05, "s_min": 1.45, "s_max": 1.55,
+#    "mc_iter": 100, "min_points": 5, "threshold": 0.005}
+import os
+os.environ.setdefault("MPLBACKEND", "Agg")
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import freeze_support
+from mist_core import AnalysisWorker, output_dir
+from mist_cache import DEFAULT_DIR as DEFAULT_CACHE_DIR
+
+# same defaults as the GUI spinners
+DEFAULT_PARAMS = {
+    'p_min': 0.95, 'p_max': 1.05, 's_min': 1.45, 's_max': 1.55,
+    'mc_iter': 100, 'min_points': 5, 'threshold': 0.005,
+    'kvw_trials': 50, 'kvw_tol': 0.001, 'workers': 1, 'plots': 'check-only', 'render_workers': 1,
+    'cache': True, 'stream': False, 'chunk_rows': 100_000,
+    'result_cache': DEFAULT_CACHE_DIR, 'result_cache_mb': 256, 'trace': True,
+    'seed': None, 'mc_adaptive': False, 'mc_tol': 0.05,
+    'windows': None, 't0': None, 'period': None, 'quad': 0.0, 'incremental': False, 'results_db': '',
+    'detect': False, 'detect_window': 1.0, 'detect_nsigma': 5.0, 'detect_flux': None
+}
+DATA_EXTS = ('.txt', '.dat', '.csv')
+
+def load_params(path):
+    params = dict(DEFAULT_PARAMS)
+    if path:
+        with open(path, encoding='utf-8') as f: user = json.load(f)
+        unknown = set(user) - set(DEFAULT_PARAMS)
+        if unknown: raise ValueError(f"unknown parameter(s) in {path}: {', '.join(sorted(unknown))}")
+        params.update(user)
+    return params
+
+def collect_files(inputs):
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found = [os.path.join(item, n) for n in os.listdir(item) if n.lower().endswith(DATA_EXTS)]
+        elif any(c in item for c in "*?["):
+            found = glob.glob(item)
+        else:
+            found = [item]
+        for f in sorted(found):
+            if os.path.isfile(f) and os.path.abspath(f) not in map(os.path.abspath, files): files.append(f)
+    return files
+
+def shared_outputs(files):
+    # {file: [other files]} of the files whose output folder another input would also write
+    by_dir = {}
+    for f in files: by_dir.setdefault(os.path.normcase(os.path.abspath(output_dir(f))), []).append(f)
+    return {f: [g for g in group if g != f] for group in by_dir.values() if len(group) > 1 for f in group}
+
+def run_file(fpath, params):
+    # Runs one file in the calling process; returns (out_dir or "ERROR", n_minima, seconds, log lines)
+    lines, out = [], []
+    worker = AnalysisWorker(dict(params, filepath=fpath))
+    worker.log.connect(lambda msg, color: lines.append(msg))
+    worker.finished.connect(out.append)
+    t0 = time.perf_counter()
+    worker.run()
+    n_min = sum(1 for m in lines if m.startswith("-> "))
+    return out[0], n_min, time.perf_counter() - t0, lines
+
+def watch(inputs, params, interval, jobs, verbose=False):
+    # Polls the inputs (new files included) and reanalyzes every file whose size or mtime changed; Ctrl+C stops
+    seen = {}
+    print(f"WATCHING {', '.join(inputs)} EVERY {interval:g} s (CTRL+C TO STOP)")
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as pool:
+        try:
+            while True:
+                stamps = {}
+                for f in collect_files(inputs):
+                    try: st = os.stat(f); stamps[f] = (st.st_size, st.st_mtime_ns)
+                    except OSError: pass
+                shared = shared_outputs(list(stamps))
+                for f in shared:
+                    if f not in seen: print(f"SKIPPED {f}: OUTPUT FOLDER SHARED WITH {', '.join(shared[f])}"); seen[f] = None
+                changed = [f for f, stamp in stamps.items() if seen.get(f) != stamp and f not in shared]
+                futures = {pool.submit(run_file, f, params): f for f in changed}
+                for fut in as_completed(futures):
+                    f = futures[fut]
+                    try: out_dir, n_min, secs, lines = fut.result()
+                    except Exception as e: out_dir, n_min, secs, lines = "ERROR", 0, 0.0, [f"CRITICAL ERROR: {e}"]
+                    new = next((m for m in lines if m.startswith("INCREMENTAL")), "")
+                    print(f"{time.strftime('%H:%M:%S')} {'FAILED' if out_dir == 'ERROR' else 'OK':<6} {f} | {n_min} NEW MINIMA | {secs:.1f} s | {new}")
+                    if verbose:
+                        for m in lines: print(f"    {m}")
+                    seen[f] = stamps[f]
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("WATCH STOPPED")
+    return 0
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="mist", description="M.I.S.T headless minima analysis")
+    ap.add_argument("inputs", nargs="+", help="observation file(s), glob pattern(s) or directories")
+    ap.add_argument("--params", help="JSON parameter file (phase windows, mc_iter, min_points, threshold, ...)")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="files analyzed in parallel (default: CPU count)")
+    ap.add_argument("-v", "--verbose", action="store_true", help="print the full log of every file")
+    ap.add_argument("--watch", type=float, metavar="SECONDS",
+                    help="keep running: check the inputs every SECONDS and update the analysis of changed files incrementally")
+    args = ap.parse_args(argv)
+
+    try: params = load_params(args.params)
+    except (OSError, ValueError) as e:
+        print(f"PARAMETER ERROR: {e}", file=sys.stderr); return 2
+    if args.watch: return watch(args.inputs, dict(params, incremental=True), args.watch, args.jobs, args.verbose)
+    files = collect_files(args.inputs)
+    if not files:
+        print("NO INPUT FILES FOUND", file=sys.stderr); return 2
+
+    # files that would write the same <name>_Detailed_Analysis folder (e.g. example.csv and example.txt)
+    # would overwrite each other's reports, figures and state: they are not run
+    shared = shared_outputs(files)
+    summary = {}
+    for f, others in shared.items():
+        summary[f] = ("FAILED", 0, 0.0, f"OUTPUT FOLDER SHARED WITH {', '.join(others)}")
+        print(f"[{len(summary)}/{len(files)}] FAILED {f}: {summary[f][3]}")
+    todo = [f for f in files if f not in shared]
+    jobs = max(1, min(args.jobs, len(todo)))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_file, f, params): f for f in todo}
+        for fut in as_completed(futures):
+            f = futures[fut]
+            try: out_dir, n_min, secs, lines = fut.result()
+            except Exception as e: out_dir, n_min, secs, lines = "ERROR", 0, 0.0, [f"CRITICAL ERROR: {e}"]
+            failed = out_dir == "ERROR"
+            detail = next((m for m in lines if m.startswith("CRITICAL ERROR")), "") if failed else out_dir
+            summary[f] = ("FAILED" if failed else "OK", n_min, secs, detail)
+            print(f"[{len(summary)}/{len(files)}] {summary[f][0]:<6} {f}")
+            if args.verbose:
+                for m in lines: print(f"    {m}")
+
+    name_w = max(len("FILE"), *(len(f) for f in files))
+    print()
+    print(f"{'FILE':<{name_w}} | {'STATUS':<6} | {'MINIMA':>6} | {'TIME [s]':>8} | OUTPUT / ERROR")
+    print("-" * (name_w + 45))
+    for f in files:
+        status, n_min, secs, detail = summary[f]
+        print(f"{f:<{name_w}} | {status:<6} | {n_min:>6} | {secs:>8.1f} | {detail}")
+    n_fail = sum(1 for v in summary.values() if v[0] == "FAILED")
+    print(f"\n{len(files) - n_fail} OK, {n_fail} FAILED")
+    return 1 if n_fail else 0
+
+if __name__ == "__main__":
+    freeze_support()
+    sys.exit(main())
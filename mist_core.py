@@ -0,0 +1,734 @@
+# Computational core of M.I.S.T: fitting engine, data loading and analysis pipeline.
+# Importable without PyQt6, so it serves the GUI (mist.py), the CLI (mist_cli.py) and pool workers.
+import os
+import glob
+import json
+import time
+import zlib
+import hashlib
+import warnings
+import threading
+import numpy as np
+from itertools import islice
+from contextlib import contextmanager, nullcontext
+import csv  
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+from datetime import datetime
+from mist_render import PlotRenderer
+from mist_cache import ResultCache, DEFAULT_DIR as DEFAULT_CACHE_DIR
+from mist_state import RunState
+
+# 1. CALCULATION ENGINE
+KVW_COARSE = 11   # trials of the coarse KvW scan (kvw_refine)
+KVW_FINE = 9      # trials per refinement of the coarse-to-fine KvW search, spanning +/-1 step of the previous level
+KVW_TOL = 0.001   # default final trial spacing [days]; 0 uses the fixed kvw_trials grid
+KVW_OVERLAP = 0.5 # the coarse scan only tries times where this fraction of the points overlaps its reflection
+
+class AstroEngine:
+    @staticmethod
+    def kvw_grid(x_c, n_trials=50):
+        # KvW trial centers over +/-1/3 of the span, with the reflected abscissae 2T - x
+        # of every trial and the mask of those that fall inside the observed range
+        center = np.mean(x_c); search = (x_c[-1] - x_c[0]) / 3
+        t_trials = np.linspace(center - search, center + search, n_trials)
+        x_ref = 2 * t_trials[:, None] - x_c[None, :]
+        mask = (x_ref >= x_c[0]) & (x_ref <= x_c[-1])
+        return center, search, t_trials, x_ref, mask
+
+    @staticmethod
+    def kvw_s(x_c, Y, T, max_elems=2_000_000):
+        # KvW symmetry S (n_rows x len(T)) of every row of Y at the shared trial times T: sum of squared
+        # differences to the reflection about T, linearly interpolated; inf below 3 overlapping points.
+        # The interpolation stencil does not depend on y, so it is built once for all rows.
+        n_rows, n = Y.shape
+        x_ref = 2 * T[:, None] - x_c[None, :]
+        mask = (x_ref >= x_c[0]) & (x_ref <= x_c[-1])
+        if n_rows == 1:
+            d = np.where(mask, Y[0] - np.interp(x_ref, x_c, Y[0]), 0.0)
+            return np.where(mask.sum(axis=1) >= 3, np.sum(d**2, axis=1), np.inf)[None, :]
+        hi = np.clip(np.searchsorted(x_c, x_ref), 1, n - 1); lo = hi - 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = np.where(mask, (x_ref - x_c[lo]) / (x_c[hi] - x_c[lo]), 0.0)
+        S = np.empty((n_rows, len(T)))
+        step = max(1, max_elems // (len(T) * n))
+        for r0 in range(0, n_rows, step):
+            Yb = Y[r0:r0+step]; y_lo = Yb[:, lo]
+            d = np.where(mask, Yb[:, None, :] - (y_lo + w * (Yb[:, hi] - y_lo)), 0.0)
+            S[r0:r0+step] = np.einsum('rtk,rtk->rt', d, d)
+        S[:, mask.sum(axis=1) < 3] = np.inf
+        return S
+
+    @staticmethod
+    def kvw_parabola(T, S, c, d, n):
+        # Parabola through the +/-5 finite samples of S around each row's minimum, as batched normal equations
+        # in u = (T - c) / d for conditioning; T is shared (n_trials) or per row, c and d scalars or per row.
+        # Returns (vertex, sigma, ok) for n points, nan / 9.999 below 3 samples or when A <= 0.
+        c, d = np.asarray(c, dtype=float), np.asarray(d, dtype=float)
+        u = np.broadcast_to((T - c[..., None]) / d[..., None], S.shape)
+        b_idx = np.argmin(S, axis=1); pos = np.arange(S.shape[1])
+        win = ((pos >= b_idx[:, None] - 5) & (pos < b_idx[:, None] + 5) & np.isfinite(S)).astype(float)
+        V = np.stack([u**2, u, np.ones_like(u)], axis=2)
+        G = np.einsum('rk,rki,rkj->rij', win, V, V)
+        h = np.einsum('rk,rki->ri', win * np.where(win > 0, S, 0.0), V)
+        ok = win.sum(axis=1) >= 3
+        G[~ok] = np.eye(3)
+        A, B, C = np.linalg.solve(G, h[..., None])[..., 0].T
+        ok &= A > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(ok, c + d * (-B / (2 * A)), np.nan)
+            sigma = np.where(ok, np.sqrt(2 * abs(C - (B**2)/(4*A)) / ((A / d**2) * (n-2))), 9.999)
+        return t, sigma, ok
+
+    @staticmethod
+    def kvw_refine(x_c, Y, tol, max_elems=2_000_000):
+        # Coarse-to-fine KvW minimum of every row of Y: KVW_COARSE trials over the times at which at least
+        # KVW_OVERLAP of the points overlap their reflection (within the +/-1/3 span of kvw_grid), then KVW_FINE
+        # trials over +/-1 step around each row's best trial until the step is below tol [days]; the parabola
+        # through the last level gives the time. Rows whose last level does not bracket the minimum keep the
+        # parabola through their coarse scan, i.e. the fixed-grid fit on the coarse trials.
+        # Trials sit on the lattice t_first + d*m, so rows whose level starts at the same m share one stencil.
+        n_rows, n = Y.shape
+        k = max(3, int(np.ceil(KVW_OVERLAP * n)))
+        center, search = np.mean(x_c), (x_c[-1] - x_c[0]) / 3
+        t_first = max((x_c[0] + x_c[k-1]) / 2, center - search); t_last = min((x_c[-1] + x_c[n-k]) / 2, center + search)
+        if not t_last > t_first: return np.full(n_rows, np.nan), np.full(n_rows, 9.999)
+        T = np.linspace(t_first, t_last, KVW_COARSE); d = T[1] - T[0]
+        S_coarse = S = AstroEngine.kvw_s(x_c, Y, T, max_elems)
+        coarse = lambda rows: AstroEngine.kvw_parabola(T, S_coarse[rows], (t_first + t_last) / 2, (t_last - t_first) / 2, n)[:2]
+        if not d > tol: return coarse(slice(None))
+        half = KVW_FINE // 2; j = np.arange(-half, half + 1)
+        M = np.broadcast_to(np.arange(KVW_COARSE), S.shape)
+        while d > tol:
+            m_best = M[np.arange(n_rows), np.argmin(S, axis=1)]
+            d /= half
+            M = (m_best * half)[:, None] + j
+            S = np.empty(M.shape)
+            for m0 in np.unique(M[:, 0]):
+                rows = M[:, 0] == m0
+                S[rows] = AstroEngine.kvw_s(x_c, Y[rows], t_first + d * (m0 + j + half), max_elems)
+        b_idx = np.argmin(S, axis=1)
+        t, sigma, ok = AstroEngine.kvw_parabola(t_first + d * M, S, t_first + d * (m_best * half), d, n)
+        ok &= (b_idx > 0) & (b_idx < KVW_FINE - 1)
+        if not ok.all(): t[~ok], sigma[~ok] = coarse(~ok)
+        return t, sigma
+
+    @staticmethod
+    def analyze_single_event(x, y, n_trials=50, tol=0.0):
+        # analyze_batch on one row, plus the fitted parabola (fx, fy) for the plot
+        x = np.asarray(x, dtype=float); y = np.asarray(y, dtype=float); x_offset = x[0]
+        t_kvw, sigma_kvw, t_par, sigma_par = (v[0] for v in AstroEngine.analyze_batch(x, y[None], n_trials, tol=tol))
+        fx, fy = [], []
+        if not np.isnan(t_par):
+            a, b, c = np.polyfit(x - x_offset, y, 2)
+            fx = np.linspace(min(x), max(x), 50); fy = a * (fx - x_offset)**2 + b * (fx - x_offset) + c
+        return t_kvw, sigma_kvw, t_par, sigma_par, fx, fy
+
+    @staticmethod
+    def analyze_batch(x, Y, n_trials=50, max_elems=2_000_000, tol=0.0):
+        # Parabolic and KvW fits for every row of Y (n_realizations x len(x)) at once; tol > 0 searches
+        # the KvW minimum coarse-to-fine to tol days (kvw_refine) instead of the n_trials grid.
+        # Returns arrays (t_kvw, sigma_kvw, t_par, sigma_par); failed rows get nan / 9.999.
+        Y = np.atleast_2d(np.asarray(Y, dtype=float)); n_real, n = Y.shape
+        x = np.asarray(x, dtype=float); x_offset = x[0]; x_c = x - x_offset
+        # Parabolic: one least-squares factorization shared by all rows
+        try:
+            coeffs, cov = np.polyfit(x_c, Y.T, 2, cov=True)
+            a, b = coeffs[0], coeffs[1]
+            var_a, var_b, cov_ab = cov[0,0], cov[1,1], cov[0,1]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t_par = (-b / (2 * a)) + x_offset
+                sigma_par = np.sqrt(abs((var_b/(4*a**2)) + ((b**2*var_a)/(4*a**4)) - ((2*b*cov_ab)/(4*a**3))))
+            bad = ~np.isfinite(t_par); t_par[bad] = np.nan; sigma_par[bad] = 9.999
+        except: t_par, sigma_par = np.full(n_real, np.nan), np.full(n_real, 9.999)
+        # KvW: the trial grid does not depend on y, so every realization is scanned with one stencil (kvw_s)
+        t_kvw, sigma_kvw = np.full(n_real, np.nan), np.full(n_real, 9.999)
+        try:
+            if tol > 0:
+                t_kvw, sigma_kvw = AstroEngine.kvw_refine(x_c, Y, tol, max_elems)
+            else:
+                center, search, t_trials, x_ref, mask = AstroEngine.kvw_grid(x_c, n_trials)
+                ti = np.flatnonzero(mask.sum(axis=1) >= 3)
+                if len(ti) <= 4: return t_kvw, sigma_kvw, t_par, sigma_par
+                s_sq = AstroEngine.kvw_s(x_c, Y, t_trials[ti], max_elems)
+                t_kvw, sigma_kvw, _ = AstroEngine.kvw_parabola(t_trials[ti], s_sq, center, search, n)
+            t_kvw = t_kvw + x_offset
+        except: t_kvw, sigma_kvw = np.full(n_real, np.nan), np.full(n_real, 9.999)
+        return t_kvw, sigma_kvw, t_par, sigma_par
+
+# 2. DATA I/O
+def sniff_format(fpath, n_lines=20):
+    # (delimiter, header rows) from the first lines: ',' or ';' if present, else whitespace.
+    # Leading lines that do not parse as numbers (column titles, comments) are skipped.
+    with open(fpath, encoding='utf-8', errors='replace') as f:
+        head = [line for _, line in zip(range(n_lines), f)]
+    skip = 0
+    for line in head:
+        fields = line.replace(',', ' ').replace(';', ' ').split()
+        try:
+            if fields and not fields[0].startswith('#'): [float(v) for v in fields]; break
+        except ValueError: pass
+        skip += 1
+    first = head[skip] if skip < len(head) else ""
+    delim = ',' if ',' in first else (';' if ';' in first else None)
+    return delim, skip
+
+def load_observations(fpath, cache=True, columns=3):
+    # BJD / mag / phase columns as an (n, 3) array (n, 2 without the phase column when columns=2),
+    # parsed in one pass with the sniffed format.
+    # The parsed array is kept as <folder>/.mist_cache/<name>.<key>.npy, where the key hashes the
+    # path, size and mtime of the file; later loads memory-map it instead of parsing text.
+    st = os.stat(fpath)
+    key = hashlib.sha1(f"{os.path.abspath(fpath)}|{st.st_size}|{st.st_mtime_ns}|{columns}".encode()).hexdigest()[:16]
+    name = os.path.basename(fpath)
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(fpath)), ".mist_cache")
+    cache_path = os.path.join(cache_dir, f"{name}.{key}.npy")
+    if cache and os.path.exists(cache_path):
+        try: return np.load(cache_path, mmap_mode='r')
+        except (OSError, ValueError): pass
+    delim, skip = sniff_format(fpath)
+    data = np.loadtxt(fpath, delimiter=delim, skiprows=skip, usecols=tuple(range(columns)), ndmin=2)
+    if cache:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            for old in glob.glob(os.path.join(glob.escape(cache_dir), glob.escape(name) + ".*.npy")): os.remove(old)
+            tmp = cache_path + ".tmp"
+            with open(tmp, 'wb') as f: np.save(f, data)
+            os.replace(tmp, cache_path)
+        except OSError: pass
+    return data
+
+def segment_window(bjd, mag, phase, p_min, p_max, lbl, min_points, gap=0.3):
+    # [(min_id, x, y), ...] for one phase window: rows inside it, sorted by time and split
+    # on gaps > `gap` days; segments shorter than min_points are dropped (and not numbered)
+    mask = (phase >= p_min) & (phase <= p_max)
+    x_f, y_f = bjd[mask], mag[mask]
+    if len(x_f) == 0: return []
+    sort = np.argsort(x_f)
+    x_s, y_s = x_f[sort], y_f[sort]
+    splits = np.where(np.diff(x_s) > gap)[0] + 1
+    chunks = [(x, y) for x, y in zip(np.split(x_s, splits), np.split(y_s, splits)) if len(x) >= min_points]
+    return [(f"{lbl}_{i}", x, y) for i, (x, y) in enumerate(chunks, 1)]
+
+def ephemeris_cycles(t, t0, period, quad=0.0):
+    # Fractional cycle count E of times t for the ephemeris T(E) = t0 + period*E + quad*E^2
+    if not quad: return (t - t0) / period
+    return (-period + np.sqrt(period**2 + 4*quad*(t - t0))) / (2*quad)
+
+def ephemeris_segments(bjd, mag, windows, t0, period, quad=0.0, min_points=5):
+    # [(min_id, x, y), ...] of every predicted eclipse: window (p_min, p_max, label) of cycle E spans
+    # T(E + p_min)..T(E + p_max). BJD is sorted once and each eclipse is sliced with searchsorted,
+    # so no phase column is needed and the cost is O(n_eclipses log n) after the sort.
+    bjd, mag = np.asarray(bjd), np.asarray(mag)
+    if len(bjd) and np.any(bjd[1:] < bjd[:-1]):
+        o = np.argsort(bjd, kind='stable'); bjd, mag = bjd[o], mag[o]
+    segments = []
+    if not len(bjd): return segments
+    e_first, e_last = ephemeris_cycles(bjd[[0, -1]], t0, period, quad)
+    eph = lambda e: t0 + period*e + quad*e**2
+    for p_min, p_max, lbl in windows:
+        cyc = np.arange(np.floor(e_first - p_max) - 1, np.ceil(e_last - p_min) + 2)
+        lo = np.searchsorted(bjd, eph(cyc + p_min), 'left'); hi = np.searchsorted(bjd, eph(cyc + p_max), 'right')
+        keep = np.flatnonzero(hi - lo >= min_points)
+        segments += [(f"{lbl}_{i}", bjd[lo[k]:hi[k]], mag[lo[k]:hi[k]]) for i, k in enumerate(keep, 1)]
+    return segments
+
+def detect_eclipses(bjd, mag, window=1.0, nsigma=5.0, min_points=5, gap=0.3, pad=1.0, flux=None):
+    # Blind search of a BJD / mag series for eclipses, without period or phase windows.
+    # Baseline is a rolling median over ~`window` days of points, the noise a MAD of the residuals;
+    # runs of points fainter than nsigma*noise (joined across gaps < `gap` days) are candidates,
+    # cut out (1 + pad) times their half-width around the centre so the fit sees ingress and egress.
+    # Fainter is above the baseline for magnitudes and below it for flux (flux=True); flux=None takes
+    # the side with more points beyond nsigma*noise, as eclipses outnumber one-sided outliers.
+    # Returns [(min_id, x, y, t_rough, depth), ...], t_rough the depth-weighted centre of the run.
+    from scipy.ndimage import median_filter
+    bjd, mag = np.asarray(bjd, dtype=float), np.asarray(mag, dtype=float)
+    if len(bjd) and np.any(bjd[1:] < bjd[:-1]):
+        o = np.argsort(bjd, kind='stable'); bjd, mag = bjd[o], mag[o]
+    if len(bjd) < 2 * min_points: return []
+    dt = np.diff(bjd); cadence = np.median(dt[dt > 0]) if np.any(dt > 0) else 1.0
+    k = int(np.clip(window / cadence, 3 * min_points, len(bjd))) | 1
+    resid = mag - median_filter(mag, size=k, mode='nearest')
+    noise = 1.4826 * np.median(np.abs(resid - np.median(resid)))
+    cut = nsigma * max(noise, 1e-12)
+    if flux is None: flux = np.sum(resid < -cut) > np.sum(resid > cut)
+    if flux: resid = -resid
+    hit = np.flatnonzero(resid > cut)
+    if not len(hit): return []
+    runs = np.split(hit, np.flatnonzero(np.diff(bjd[hit]) > gap) + 1)
+    cands = []
+    for run in runs:
+        if len(run) < min_points: continue
+        w = resid[run]; t_c = float(np.sum(w * bjd[run]) / np.sum(w))
+        # symmetric about the rough minimum, so a night that starts or ends inside the eclipse is not cut lopsided
+        h = (1 + pad) * max(t_c - bjd[run[0]], bjd[run[-1]] - t_c)
+        lo = np.searchsorted(bjd, t_c - h, 'left'); hi = np.searchsorted(bjd, t_c + h, 'right')
+        cands.append((bjd[lo:hi], mag[lo:hi], t_c, float(w.max())))
+    return [(f"Eclipse_{i}", x, y, t, d) for i, (x, y, t, d) in enumerate(cands, 1)]
+
+def stream_segments(fpath, windows, min_points, chunk_rows=100_000, gap=0.3, on_progress=None, ephemeris=None):
+    # Yields (min_id, x, y) eclipse segments of the (p_min, p_max, label) phase windows while reading
+    # the file chunk_rows lines at a time. Only rows inside a window are kept, and a window's open
+    # segment is handed out as soon as a later row opens a gap > `gap` days, so memory is bounded by
+    # the largest eclipse. Rows must be in time order, up to shuffles within one segment.
+    # With ephemeris=(t0, period, quad) the phase is computed from BJD and the file needs two columns.
+    delim, skip = sniff_format(fpath)
+    size = max(1, os.path.getsize(fpath)); read = 0
+    open_x, open_y = [[] for _ in windows], [[] for _ in windows]
+    t_max, count = [-np.inf] * len(windows), [0] * len(windows)
+
+    def close(k):
+        x, y = np.concatenate(open_x[k]), np.concatenate(open_y[k])
+        open_x[k], open_y[k] = [], []
+        if len(x) < min_points: return None
+        o = np.argsort(x, kind='stable'); count[k] += 1
+        return f"{windows[k][2]}_{count[k]}", x[o], y[o]
+
+    with open(fpath, encoding='utf-8', errors='replace') as f:
+        for _ in islice(f, skip): pass
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if not lines: break
+            read += sum(map(len, lines))
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)   # blocks of blank/comment lines
+                data = np.loadtxt(lines, delimiter=delim, usecols=(0, 1) if ephemeris else (0, 1, 2), ndmin=2)
+            cyc = ephemeris_cycles(data[:,0], *ephemeris) if ephemeris else None
+            for k, (p_min, p_max, _) in enumerate(windows):
+                ph = (cyc - p_min) % 1 + p_min if ephemeris else data[:,2]
+                sel = (ph >= p_min) & (ph <= p_max)
+                xs, ys = data[sel, 0], data[sel, 1]
+                if not len(xs): continue
+                run_max = np.maximum.accumulate(np.concatenate([[t_max[k]], xs]))[:-1]
+                if np.any(xs < run_max - gap):
+                    raise ValueError("streaming mode needs the observations sorted by BJD")
+                t_max[k] = max(t_max[k], xs.max())
+                new_seg = xs - run_max > gap
+                bounds = [0, *(np.flatnonzero(new_seg[1:]) + 1), len(xs)]
+                for i0, i1 in zip(bounds[:-1], bounds[1:]):
+                    if new_seg[i0] and open_x[k]:
+                        seg = close(k)
+                        if seg: yield seg
+                    open_x[k].append(xs[i0:i1]); open_y[k].append(ys[i0:i1])
+            if on_progress: on_progress(min(1.0, read / size))
+    for k in range(len(windows)):
+        seg = close(k) if open_x[k] else None
+        if seg: yield seg
+
+# 3. RUN TRACE
+class RunTrace:
+    # Wall time and call count per pipeline stage plus per-event timings, written as run_trace.json.
+    # A disabled trace hands out a shared no-op context and records nothing.
+    _NULL = nullcontext()
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.t0 = time.perf_counter()
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.stages = {}
+        self.events = []
+
+    def add(self, name, seconds, calls=1):
+        if not self.enabled: return
+        st = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        st['seconds'] += seconds; st['calls'] += calls
+
+    @contextmanager
+    def _timed(self, name):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.add(name, time.perf_counter() - t0)
+
+    def stage(self, name):
+        return self._timed(name) if self.enabled else self._NULL
+
+    def event(self, ev):
+        # per-event record; 'timing' comes back from process_event, possibly from a pool worker
+        if not self.enabled or ev is None: return
+        for name, seconds in ev['timing'].items(): self.add(name, seconds)
+        self.events.append({'ID': ev['ID'], 'status': ev['Status'], 'cached': ev['cached'], 'mc_n': ev['MC_N'], **ev['timing']})
+
+    def summary(self):
+        parts = [f"{name} {st['seconds']:.2f}s" + (f" ({st['calls']})" if st['calls'] > 1 else "")
+                 for name, st in self.stages.items()]
+        return " | ".join(parts + [f"total {time.perf_counter() - self.t0:.2f}s"])
+
+    def write(self, path, **meta):
+        trace = {**meta, 'started': self.started, 'total_seconds': time.perf_counter() - self.t0, 'stages': self.stages, 'events': self.events}
+        with open(path, 'w', encoding='utf-8') as f: json.dump(trace, f, indent=1, default=str)
+
+# 4. WORKER 
+MC_BLOCK = 25   # realizations per convergence check in adaptive MC
+MC_MIN = 300    # realizations before an adaptive MC may stop
+MC_STABLE = 2   # consecutive blocks within mc_tol that stop an adaptive MC
+MC_CHUNK = 500_000  # realizations x points per batch of a fixed-size MC, so a cancel is seen within one batch
+
+class AnalysisCancelled(Exception):
+    # raised inside an event when the run is cancelled; the event is dropped, finished ones are kept
+    pass
+
+def event_rng(seed, min_id):
+    # Generator of one event, derived from the run seed and the event ID only, so an event draws
+    # the same noise whatever order or process it runs in
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(zlib.crc32(min_id.encode()),)))
+
+def robust_std(v):
+    # 1.4826 * median absolute deviation: the standard deviation of Gaussian values, insensitive to the
+    # few realizations whose KvW minimum lands far off
+    return 1.4826 * np.median(np.abs(v - np.median(v))) if len(v) else np.nan
+
+def analyze_event(x_chunk, y_chunk, p, rng=np.random, stop=None):
+    # Threshold-independent part of an event: fits, Monte Carlo sigmas, fit curve and residuals
+    # (None if the parabola fails). This is what the result cache stores.
+    # The sigmas are the standard deviations of the MC times. With p['mc_adaptive'] they are robust_std
+    # instead, and the MC runs in blocks of MC_BLOCK until, after at least MC_MIN realizations, both have
+    # changed by less than p['mc_tol'] (relative) over MC_STABLE blocks in a row; p['mc_iter'] is the cap.
+    # stop() is polled before every MC block and raises AnalysisCancelled when it returns True.
+    n_trials, kvw_tol = p.get('kvw_trials', 50), p.get('kvw_tol', KVW_TOL)
+    t0 = time.perf_counter()
+    t_kvw, e_kvw, t_par, e_par, fx, fy = AstroEngine.analyze_single_event(x_chunk, y_chunk, n_trials, kvw_tol)
+    if np.isnan(t_par): return None
+    x_off = x_chunk[0]
+    c_poly = np.polyfit(x_chunk - x_off, y_chunk, 2)
+    resid = y_chunk - np.poly1d(c_poly)(x_chunk - x_off)
+    noise = np.std(resid)
+    t1 = time.perf_counter()
+
+    # noise realizations are fitted in batched calls of MC_BLOCK when adaptive, otherwise of up to
+    # MC_CHUNK values; the draws are sequential, so the realizations do not depend on the batch size
+    cap, tol, adaptive = p['mc_iter'], p.get('mc_tol', 0.05), p.get('mc_adaptive', False)
+    block = MC_BLOCK if adaptive else max(1, MC_CHUNK // len(y_chunk))
+    spread = robust_std if adaptive else np.std
+    mc_kvw, mc_par, n_mc, last, stable = np.empty(0), np.empty(0), 0, None, 0
+    while n_mc < cap:
+        if stop is not None and stop(): raise AnalysisCancelled()
+        m = min(block, cap - n_mc)
+        y_n = y_chunk + rng.normal(0, noise, (m, len(y_chunk)))
+        mk, _, mp, _ = AstroEngine.analyze_batch(x_chunk, y_n, n_trials, tol=kvw_tol)
+        mc_kvw = np.concatenate([mc_kvw, mk[~np.isnan(mk)]]); mc_par = np.concatenate([mc_par, mp[~np.isnan(mp)]])
+        n_mc += m
+        if not adaptive: continue
+        sd = np.array([robust_std(mc_kvw), robust_std(mc_par)])
+        stable = stable + 1 if last is not None and np.all(np.abs(sd - last) <= tol * sd) else 0
+        if stable >= MC_STABLE and n_mc >= MC_MIN: break
+        last = sd
+    fe_kvw = spread(mc_kvw) if len(mc_kvw) else e_kvw
+    fe_par = spread(mc_par) if len(mc_par) else e_par
+    return {'KvW': t_kvw, 'e_KvW': fe_kvw, 'Par': t_par, 'e_Par': fe_par, 'fx': np.asarray(fx), 'fy': np.asarray(fy), 'resid': resid,
+            'mc_n': n_mc, 'timing': {'fit': t1 - t0, 'mc': time.perf_counter() - t1}}
+
+def process_event(x_chunk, y_chunk, min_id, p, seed=None, cache=None, stop=None):
+    # One eclipse segment: cached or fresh analysis plus the OK/CHECK status (None if the fit fails).
+    # Module level so that pool workers can run it; 'plot' carries the data for the renderer.
+    # The MC noise comes from event_rng(seed, min_id).
+    t0 = time.perf_counter()
+    key = cache.key(x_chunk, y_chunk, min_id, p) if cache else None
+    res = cache.get(key) if cache else None
+    cached = res is not None
+    if not cached:
+        res = analyze_event(x_chunk, y_chunk, p, event_rng(seed, min_id), stop)
+        if cache: cache.put(key, res)
+    if not res: return None
+    if cached: res['timing'] = {'cache': time.perf_counter() - t0}
+    status = "CHECK" if abs(res['KvW'] - res['Par']) > p['threshold'] else "OK"
+    return {'ID': min_id, 'KvW': res['KvW'], 'e_KvW': res['e_KvW'], 'Par': res['Par'], 'e_Par': res['e_Par'],
+            'N': len(x_chunk), 'MC_N': int(res['mc_n']), 'Status': status, 'cached': cached, 'timing': res['timing'],
+            'plot': (x_chunk, y_chunk, res['fx'], res['fy'], res['resid'])}
+
+# Observation arrays are handed to pool workers through one shared-memory block per run;
+# tasks only carry offsets into it. Blocks created by this process are looked up directly,
+# a worker process keeps only its most recent attachment open.
+_SHM_LOCAL = {}
+_SHM_ATTACHED = None
+
+def _shared_array(name, shape):
+    global _SHM_ATTACHED
+    if name in _SHM_LOCAL: return _SHM_LOCAL[name]
+    if _SHM_ATTACHED is None or _SHM_ATTACHED[0] != name:
+        if _SHM_ATTACHED is not None: _SHM_ATTACHED[1].close()
+        _SHM_ATTACHED = (name, shared_memory.SharedMemory(name=name))
+    return np.ndarray(shape, dtype=np.float64, buffer=_SHM_ATTACHED[1].buf)
+
+def _process_shared_event(name, shape, start, stop, min_id, p, seed, cache):
+    xy = _shared_array(name, shape)
+    x_chunk, y_chunk = xy[0, start:stop].copy(), xy[1, start:stop].copy()
+    return process_event(x_chunk, y_chunk, min_id, p, seed, cache)
+
+class Signal:
+    # Minimal stand-in for a Qt signal so the pipeline runs without a QApplication
+    def __init__(self):
+        self.slots = []
+    def connect(self, slot):
+        self.slots.append(slot)
+    def emit(self, *args):
+        for slot in self.slots: slot(*args)
+
+def output_dir(fpath):
+    # <folder>/<name up to the first dot>_Detailed_Analysis: the folder a run of fpath writes into
+    return os.path.join(os.path.dirname(fpath), f"{os.path.basename(fpath).split('.')[0]}_Detailed_Analysis")
+
+class AnalysisWorker:
+    def __init__(self, params, executor=None):
+        self.finished = Signal()
+        self.progress = Signal()
+        self.log = Signal()
+        self.p = params
+        self.engine = AstroEngine()
+        # any concurrent.futures executor; otherwise a process pool is created when params['workers'] > 1
+        self.executor = executor
+        self.renderer = None
+        self.cache = None
+        self.trace = RunTrace(False)
+        self.seed = None
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        # Thread-safe: the run stops before its next event (or MC block) and reports what is finished
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def run(self):
+        try:
+            self.trace = RunTrace(self.p.get('trace', True))
+            fpath = self.p['filepath']
+            base = os.path.basename(fpath).split('.')[0]
+            out_dir = output_dir(fpath)
+            os.makedirs(out_dir, exist_ok=True)
+            eps_dir = os.path.join(out_dir, "EPS_Figures")
+            # figures are rendered in the background while the analysis continues
+            self.renderer = PlotRenderer(self.p.get('plots', 'check-only'), out_dir, eps_dir, self.p.get('render_workers', 1))
+            # incremental: only rows appended since the last run are parsed (see mist_state)
+            stream = self.p.get('stream', False) and not self.p.get('detect', False)
+            state = RunState(out_dir, self.p) if self.p.get('incremental', False) and not stream else None
+            # results are only reusable for a fixed seed: a cached entry of an unseeded run came from
+            # another seed than the one this run reports
+            cache_dir = self.p.get('result_cache', DEFAULT_CACHE_DIR) if self.p.get('seed') is not None else ''
+            self.cache = ResultCache(cache_dir, self.p.get('result_cache_mb', 256)) if cache_dir else None
+            # without a fixed seed every run draws fresh entropy; it is reported so the run can be repeated
+            self.seed = self.p.get('seed')
+            # an unseeded incremental run keeps the seed of the events it takes over from the last one
+            if self.seed is None and state: self.seed = state.seed
+            if self.seed is None: self.seed = np.random.SeedSequence().entropy
+            self.log.emit(f"SESSION START: {base}", "#FFFFFF")            
+            self.log.emit(f"RUN SEED: {self.seed}", "#90A4AE")
+            if self.p.get('result_cache', DEFAULT_CACHE_DIR) and self.cache is None: self.log.emit("RESULT CACHE: OFF WITHOUT A FIXED SEED", "#90A4AE")
+            header_line = f"{'ID':<15} | {'KvW Time':<15} +/- {'Err':<10} | {'Par Time':<15} +/- {'Err':<10} | {'Status':<6} | {'MC N'}"
+            separator = "-" * len(header_line)
+            results = [f"ANALYSIS REPORT: {base}", f"DATE: {datetime.now().strftime('%Y-%m-%d %H:%M')}", f"SEED: {self.seed}",
+                       f"MC ERRORS: {'1.4826*MAD (ADAPTIVE)' if self.p.get('mc_adaptive') else 'STD'}", "-"*50, header_line, separator]            
+            ml_data = []
+            ranges = [
+                (self.p['p_min'], self.p['p_max'], "Primary"),
+                (self.p['s_min'], self.p['s_max'], "Secondary")
+            ]
+            # any number of named (p_min, p_max, label) windows may replace the two above
+            if self.p.get('windows'): ranges = [(float(a), float(b), str(lbl)) for a, b, lbl in self.p['windows']]
+            # with an ephemeris the windows are predicted from BJD and the phase column is not read
+            ephemeris = (self.p['t0'], self.p['period'], self.p.get('quad') or 0.0) if self.p.get('period') else None
+            # blind detection finds the eclipses in BJD / mag alone; it needs neither windows nor ephemeris
+            detect = self.p.get('detect', False)
+            if detect: ephemeris = None
+            if ephemeris: self.log.emit(f"EPHEMERIS: T0 = {ephemeris[0]} | P = {ephemeris[1]} | Q = {ephemeris[2]}", "#29B6F6")
+
+            if detect and self.p.get('stream', False): self.log.emit("BLIND DETECTION NEEDS THE WHOLE SERIES: STREAM IGNORED", "#FFA726")
+            if stream:
+                self.log.emit("STREAMING DATA (PHASE WINDOWS ONLY)...", "#29B6F6")
+                self.progress.emit(10)
+                with self.trace.stage('stream+analyze'):
+                    events = computed = self.run_streaming(fpath, ranges, ephemeris)
+            else:
+                with self.trace.stage('load'):
+                    if state: data, n_new = state.observations(fpath, 2 if ephemeris or detect else 3, *sniff_format(fpath))
+                    else: data = load_observations(fpath, self.p.get('cache', True), 2 if ephemeris or detect else 3)
+                bjd, mag = data[:,0], data[:,1]
+                src = f" ({n_new} NEW)" if state else " (CACHED)" if isinstance(data, np.memmap) else ""
+                self.log.emit(f"DATA LOADED: {len(bjd)} ROWS{src}", "#00E676")
+                self.progress.emit(10)
+
+                segments = []
+                if detect:
+                    self.log.emit("DETECTING ECLIPSES...", "#29B6F6")
+                    with self.trace.stage('detect'):
+                        cands = detect_eclipses(bjd, mag, self.p.get('detect_window', 1.0), self.p.get('detect_nsigma', 5.0), self.p['min_points'],
+                                                flux=self.p.get('detect_flux'))
+                    segments = [(min_id, x, y) for min_id, x, y, _, _ in cands]
+                    self.log.emit(f"CANDIDATES: {len(cands)}" + (f" | DEPTH {min(c[4] for c in cands):.3f}-{max(c[4] for c in cands):.3f}" if cands else ""), "#00E676")
+                    if not cands: self.log.emit(f"NO ECLIPSES FOUND AT {self.p.get('detect_nsigma', 5.0):g} SIGMA: CHECK detect_nsigma / detect_window / detect_flux", "#FFA726")
+                    with open(os.path.join(out_dir, "Eclipse_Candidates.csv"), 'w', newline='', encoding='utf-8') as f:
+                        writer = csv.writer(f)
+                        writer.writerow(['ID', 'T_Rough', 'Depth', 'N'])
+                        writer.writerows((min_id, f"{t:.5f}", f"{d:.4f}", len(x)) for min_id, x, _, t, d in cands)
+                elif ephemeris:
+                    self.log.emit(f"PREDICTING {', '.join(lbl.upper() for _, _, lbl in ranges)}...", "#29B6F6")
+                    with self.trace.stage('segment'):
+                        segments = ephemeris_segments(bjd, mag, ranges, *ephemeris, self.p['min_points'])
+                else:
+                    for p_min, p_max, lbl in ranges:
+                        self.log.emit(f"SCANNING {lbl.upper()}...", "#29B6F6")
+                        with self.trace.stage('segment'):
+                            segments += segment_window(bjd, mag, data[:,2], p_min, p_max, lbl, self.p['min_points'])
+
+                # segments the previous incremental run finalized with the same data are taken over,
+                # without fitting or drawing them again
+                known = state.lookup(segments) if state else {}
+                todo = [seg for k, seg in enumerate(segments) if k not in known]
+                if state: self.log.emit(f"INCREMENTAL: {len(known)}/{len(segments)} EVENTS UNCHANGED", "#90A4AE")
+
+                # events come back in segment order whichever way they were executed
+                with self.trace.stage('analyze'):
+                    if self.executor is not None or self.p.get('workers', 1) > 1:
+                        computed = self.run_parallel(todo) if todo else []
+                    else:
+                        computed = []
+                        for i, (min_id, x_chunk, y_chunk) in enumerate(todo):
+                            if self.cancelled: break
+                            try: computed.append(process_event(x_chunk, y_chunk, min_id, self.p, self.seed, self.cache, self._cancel.is_set))
+                            except AnalysisCancelled: break
+                            self.event_done(computed[-1], i + 1, len(todo))
+                computed += [None] * (len(todo) - len(computed))   # segments skipped by a cancel
+                fresh = iter(computed)
+                events = [known[k] if k in known else next(fresh) for k in range(len(segments))]
+            if self.cache is not None:
+                hits = sum(1 for ev in computed if ev is not None and ev['cached'])
+                self.log.emit(f"RESULT CACHE: {hits}/{sum(ev is not None for ev in computed)} EVENTS REUSED", "#90A4AE")
+                self.cache.evict()
+            for ev in events:
+                if ev is None: continue
+                results.append(f"{ev['ID']:<15} | {ev['KvW']:.5f} +/- {ev['e_KvW']:.5f} | {ev['Par']:.5f} +/- {ev['e_Par']:.5f} | {ev['Status']:<6} | {ev['MC_N']}")
+                ml_data.append({'ID': ev['ID'], 'KvW': ev['KvW'], 'Par': ev['Par'], 'Status': ev['Status']})
+
+            # REPORT.TXT 
+            if self.cancelled: results.insert(3, "STATUS: CANCELLED (PARTIAL RESULTS)")
+            report_t0 = time.perf_counter()
+            with open(os.path.join(out_dir, "Minima_Report.txt"), "w") as f: f.write("\n".join(results))
+            
+            # CSV 
+            if ml_data:
+                csv_path = os.path.join(out_dir, "ML_Data.csv")
+                try:
+                    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+                        writer = csv.DictWriter(f, fieldnames=['ID', 'KvW', 'Par', 'Status'])
+                        writer.writeheader()
+                        writer.writerows(ml_data)
+                except Exception as e:
+                    self.log.emit(f"CSV ERROR: {str(e)}", "#FF5555")            
+            self.trace.add('report', time.perf_counter() - report_t0)
+            self.log.emit("REPORT WRITTEN", "#00E676")
+            if self.cancelled:
+                # partial results stay in the report, the CSV and the result cache; the run is not
+                # recorded as finished in the incremental state or the results database
+                n_done = sum(ev is not None for ev in events)
+                self.log.emit(f"ANALYSIS CANCELLED: {n_done} MINIMA KEPT", "#FFB74D")
+                self.renderer.close()
+                self.finished.emit(out_dir)
+                return
+            if state: state.save(segments, events, self.seed)
+            # with an ephemeris the run also gets its O-C table and refitted linear / quadratic ephemerides;
+            # the cycle offset of every window is its centre
+            if ephemeris and ml_data:
+                from mist_oc import event_rows, oc_tables, window_offsets, write_csv, OC_COLUMNS, FIT_COLUMNS
+                with self.trace.stage('o-c'):
+                    table, fits = oc_tables(event_rows(base, events), {base: ephemeris}, offsets=window_offsets(ranges))
+                    write_csv(os.path.join(out_dir, "OC_Table.csv"), table, OC_COLUMNS)
+                    write_csv(os.path.join(out_dir, "OC_Ephemeris.csv"), fits, FIT_COLUMNS)
+                for f in fits:
+                    self.log.emit(f"EPHEMERIS FIT ({'LINEAR' if f['degree'] == 1 else 'QUADRATIC'}): T0 = {f['t0']:.6f} | "
+                                  f"P = {f['period']:.8f} +/- {f['e_period']:.8f} | {f['n_used']}/{f['n']} USED", "#00E676")
+            if self.p.get('results_db'):
+                from mist_db import ResultsDB
+                with self.trace.stage('results db'), ResultsDB(self.p['results_db']) as db:
+                    run_id = db.add_run(base, fpath, self.p, self.seed, events)
+                self.log.emit(f"RESULTS DB: RUN {run_id} -> {self.p['results_db']}", "#00E676")
+
+            if self.renderer.futures:
+                self.log.emit(f"RENDERING {len(self.renderer.futures)} FIGURES...", "#29B6F6")
+                with self.trace.stage('render wait'):
+                    errors = self.renderer.wait(lambda done, total: self.progress.emit(90 + int((done/total)*10)))
+                for min_id, err in errors.items(): self.log.emit(f"PLOT ERROR {min_id}: {err}", "#FF5555")
+                if self.renderer.seconds: self.trace.add('render', self.renderer.seconds, len(self.renderer.futures) - len(errors))
+            if self.trace.enabled:
+                self.trace.write(os.path.join(out_dir, "run_trace.json"), file=fpath, seed=self.seed,
+                                 params={k: v for k, v in self.p.items() if isinstance(v, (int, float, str, bool, type(None)))})
+                self.log.emit(f"TIMING: {self.trace.summary()}", "#90A4AE")
+            self.progress.emit(100)
+            self.log.emit("ANALYSIS COMPLETED SUCCESSFULLY", "#00E676")
+            self.finished.emit(out_dir)
+        except Exception as e:
+            self.log.emit(f"CRITICAL ERROR: {str(e)}", "#FF0000")
+            self.finished.emit("ERROR")
+        finally:
+            if self.renderer is not None: self.renderer.close()
+
+    def run_parallel(self, segments):
+        sizes = [len(x_chunk) for _, x_chunk, _ in segments]
+        stops = np.cumsum(sizes); starts = stops - sizes
+        shape = (2, int(stops[-1]) if len(stops) else 0)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, shape[1] * 2 * 8))
+        xy = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        for (_, x_chunk, y_chunk), i0, i1 in zip(segments, starts, stops):
+            xy[0, i0:i1], xy[1, i0:i1] = x_chunk, y_chunk
+        _SHM_LOCAL[shm.name] = xy
+        executor = self.executor or ProcessPoolExecutor(max_workers=self.p.get('workers'))
+        try:
+            futures = {executor.submit(_process_shared_event, shm.name, shape, int(i0), int(i1),
+                                       min_id, self.p, self.seed, self.cache): k
+                       for k, ((min_id, _, _), i0, i1) in enumerate(zip(segments, starts, stops))}
+            events = [None] * len(segments)
+            for done, fut in enumerate(as_completed(futures), 1):
+                if fut.cancelled(): continue
+                events[futures[fut]] = fut.result()
+                self.event_done(events[futures[fut]], done, len(segments))
+                # on cancel, queued events are dropped and the running ones are still collected
+                if self.cancelled:
+                    for f in futures: f.cancel()
+            return events
+        finally:
+            if executor is not self.executor: executor.shutdown(cancel_futures=True)
+            del _SHM_LOCAL[shm.name], xy
+            shm.close(); shm.unlink()
+
+    def run_streaming(self, fpath, ranges, ephemeris=None):
+        # Each segment is analyzed as soon as stream_segments completes it. With a pool, at most
+        # 2 * workers segments are in flight, so memory stays bounded by a few eclipses.
+        segs = stream_segments(fpath, ranges, self.p['min_points'], self.p.get('chunk_rows', 100_000),
+                               on_progress=lambda frac: self.progress.emit(10 + int(frac*80)), ephemeris=ephemeris)
+        events = []
+        if self.executor is None and self.p.get('workers', 1) <= 1:
+            for min_id, x_chunk, y_chunk in segs:
+                if self.cancelled: break
+                try: events.append(process_event(x_chunk, y_chunk, min_id, self.p, self.seed, self.cache, self._cancel.is_set))
+                except AnalysisCancelled: break
+                self.event_done(events[-1])
+        else:
+            executor = self.executor or ProcessPoolExecutor(max_workers=self.p.get('workers'))
+            max_pending, pending = 2 * max(1, self.p.get('workers', 1)), set()
+            def collect(futs):
+                for fut in futs:
+                    events.append(fut.result()); self.event_done(events[-1])
+            try:
+                for min_id, x_chunk, y_chunk in segs:
+                    if self.cancelled: break
+                    pending.add(executor.submit(process_event, x_chunk, y_chunk, min_id, self.p, self.seed, self.cache))
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED); collect(done)
+                collect(as_completed(pending))
+            finally:
+                if executor is not self.executor: executor.shutdown(cancel_futures=True)
+        # same Primary_N..., Secondary_N... order as the in-memory path
+        order = {lbl: k for k, (_, _, lbl) in enumerate(ranges)}
+        def key(ev):
+            lbl, n = ev['ID'].rsplit('_', 1)
+            return order[lbl], int(n)
+        return sorted((ev for ev in events if ev is not None), key=key)
+
+    def event_done(self, ev, done=None, total=None):
+        self.trace.event(ev)
+        if ev is not None:
+            color_log = "#FF5555" if ev['Status'] == "CHECK" else "#90A4AE"
+            self.log.emit(f"-> {ev['ID']} ({ev['Status']})", color_log)
+            self.renderer.submit(ev)
+            ev.pop('plot', None)   # figure data is no longer needed once queued
+        if total: self.progress.emit(10 + int((done/total)*80))
@@ -0,0 +1,107 @@
+# Optional SQLite store of the minima of every run, across targets.
+# AnalysisWorker adds one run per analysis when params['results_db'] names a database file;
+# query() and the command line below pull O-C ready tables out of it without touching the reports.
+#
+#   python mist_db.py results.db [--target NAME] [--kind Primary] [--status OK] [--since BJD] [--until BJD]
+#                                [--method kvw|par] [--all-runs] [--out table.csv] [--targets]
+import os
+import sys
+import csv
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY, target TEXT NOT NULL, file TEXT, started TEXT, seed TEXT, params TEXT);
+CREATE TABLE IF NOT EXISTS minima (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id), target TEXT NOT NULL, min_id TEXT NOT NULL, kind TEXT,
+    kvw REAL, e_kvw REAL, par REAL, e_par REAL, status TEXT, n_points INTEGER, mc_n INTEGER);
+CREATE INDEX IF NOT EXISTS minima_target ON minima (target, kvw);
+CREATE INDEX IF NOT EXISTS minima_time ON minima (kvw);
+CREATE INDEX IF NOT EXISTS minima_run ON minima (run_id);
+CREATE INDEX IF NOT EXISTS runs_target ON runs (target, run_id);
+"""
+COLUMNS = ('target', 'min_id', 'kind', 'kvw', 'e_kvw', 'par', 'e_par', 'status', 'n_points', 'mc_n', 'run_id')
+
+class ResultsDB:
+    def __init__(self, path):
+        self.path = path
+        # WAL lets batch jobs in several processes write while others read; writers wait for the lock
+        self.con = sqlite3.connect(path, timeout=60)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.executescript(SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+
+    def add_run(self, target, file, params, seed, events):
+        # One run and all its events in a single transaction; returns the run_id
+        params = json.dumps({k: v for k, v in params.items() if k != 'filepath'}, default=str, sort_keys=True)
+        with self.con:
+            cur = self.con.execute("INSERT INTO runs (target, file, started, seed, params) VALUES (?, ?, ?, ?, ?)",
+                                   (target, os.path.abspath(file), datetime.now().isoformat(timespec='seconds'), str(seed), params))
+            run_id = cur.lastrowid
+            self.con.executemany(
+                "INSERT INTO minima VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((run_id, target, ev['ID'], ev['ID'].rsplit('_', 1)[0], ev['KvW'], ev['e_KvW'], ev['Par'], ev['e_Par'],
+                  ev['Status'], ev['N'], ev['MC_N']) for ev in events if ev is not None))
+        return run_id
+
+    def targets(self):
+        # [(target, runs, minima of the latest run, latest run start)]
+        return self.con.execute(
+            "SELECT r.target, COUNT(*), (SELECT COUNT(*) FROM minima m WHERE m.run_id = MAX(r.run_id)), MAX(r.started) "
+            "FROM runs r GROUP BY r.target ORDER BY r.target").fetchall()
+
+    def query(self, target=None, kind=None, status=None, since=None, until=None, all_runs=False):
+        # Rows (dicts with COLUMNS) ordered by target and KvW time; by default only each target's latest run
+        where, args = [], []
+        if not all_runs: where.append("m.run_id = (SELECT MAX(run_id) FROM runs r WHERE r.target = m.target)")
+        for col, op, val in (('m.target', '=', target), ('m.kind', '=', kind), ('m.status', '=', status),
+                             ('m.kvw', '>=', since), ('m.kvw', '<=', until)):
+            if val is not None: where.append(f"{col} {op} ?"); args.append(val)
+        sql = f"SELECT {', '.join('m.' + c for c in COLUMNS)} FROM minima m"
+        if where: sql += " WHERE " + " AND ".join(where)
+        rows = self.con.execute(sql + " ORDER BY m.target, m.kvw", args).fetchall()
+        return [dict(zip(COLUMNS, r)) for r in rows]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="mist-db", description="Query the M.I.S.T results database")
+    ap.add_argument("db", help="SQLite file written through params['results_db']")
+    ap.add_argument("--target", help="target name (observation file name without extension)")
+    ap.add_argument("--kind", help="window label, e.g. Primary or Secondary")
+    ap.add_argument("--status", choices=("OK", "CHECK"))
+    ap.add_argument("--since", type=float, help="earliest KvW time")
+    ap.add_argument("--until", type=float, help="latest KvW time")
+    ap.add_argument("--method", choices=("kvw", "par", "both"), default="both", help="timing columns to export")
+    ap.add_argument("--all-runs", action="store_true", help="include every run, not only the latest per target")
+    ap.add_argument("--out", help="CSV file (default: standard output)")
+    ap.add_argument("--targets", action="store_true", help="list the targets instead")
+    args = ap.parse_args(argv)
+    if not os.path.exists(args.db):
+        print(f"NO DATABASE: {args.db}", file=sys.stderr); return 2
+
+    with ResultsDB(args.db) as db:
+        if args.targets:
+            for target, runs, n_min, started in db.targets(): print(f"{target:<30} {runs:>5} RUNS  {n_min:>6} MINIMA  {started}")
+            return 0
+        rows = db.query(args.target, args.kind, args.status, args.since, args.until, args.all_runs)
+    drop = {'kvw': ('par', 'e_par'), 'par': ('kvw', 'e_kvw'), 'both': ()}[args.method]
+    fields = [c for c in COLUMNS if c not in drop]
+    f = open(args.out, 'w', newline='', encoding='utf-8') if args.out else sys.stdout
+    try:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader(); writer.writerows(rows)
+    finally:
+        if args.out: f.close()
+    if args.out: print(f"{len(rows)} MINIMA WRITTEN: {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
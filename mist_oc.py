@@ -0,0 +1,180 @@
+# O-C tables and ephemeris fits for the minima of one run or of many targets at once.
+# Cycle numbers are assigned with the initial ephemeris of each target (integer for primaries,
+# half-integer for secondaries, window centre + integer for other windows); weighted linear and quadratic ephemerides are then fitted with the
+# Monte Carlo errors as weights and iterative sigma-clipping, all targets in the same batched call.
+#
+#   python mist_oc.py SOURCE [SOURCE ...] [--ephemeris eph.csv] [--t0 T0 --period P [--quad Q]]
+#                     [--method kvw|par] [--status OK] [--clip 3] [--offset LABEL=PHASE ...]
+#                     [--out oc.csv] [--fits fits.csv]
+#
+# SOURCE is a results database (mist_db), a Minima_Report.txt or a *_Detailed_Analysis folder.
+# eph.csv has the columns target,t0,period and optionally quad; --t0/--period cover the other targets.
+import os
+import sys
+import csv
+import argparse
+import numpy as np
+
+# phase of each window label in cycles; NaN = nearest half cycle (blind detections are primary or secondary
+# eclipses). Minima of labels without an offset get a half-cycle E in the table but stay out of the fits.
+KIND_OFFSETS = {'Primary': 0.0, 'Secondary': 0.5, 'Eclipse': np.nan}
+OC_COLUMNS = ('target', 'min_id', 'kind', 'status', 'E', 'T', 'e_T', 'OC', 'OC_lin', 'OC_quad', 'used_lin', 'used_quad')
+FIT_COLUMNS = ('target', 'degree', 't0', 'e_t0', 'period', 'e_period', 'quad', 'e_quad', 'n', 'n_used', 'chi2')
+
+def ephemeris_time(E, t0, period, quad=0.0):
+    return t0 + period * E + quad * E**2
+
+def cycle_numbers(t, t0, period, quad=0.0, offset=0.0):
+    # Cycle number E of each time: nearest integer + offset (0 primary, 0.5 secondary), nearest half cycle where offset is NaN
+    t, offset = np.asarray(t, dtype=float), np.asarray(offset, dtype=float)
+    quad = np.asarray(quad, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        e = np.where(quad != 0, (-period + np.sqrt(period**2 + 4*quad*(t - t0))) / (2*np.where(quad != 0, quad, 1)), (t - t0) / period)
+    return np.where(np.isnan(offset), np.round(2 * e) / 2, np.round(e - np.nan_to_num(offset)) + np.nan_to_num(offset))
+
+def fit_ephemerides(group, E, T, e_T, t0, period, quad=0.0, degree=1, clip=3.0, max_iter=10):
+    # Weighted least-squares ephemerides of G targets in one pass: row i belongs to target group[i] and
+    # t0/period/quad (length G) are the initial ephemerides the corrections are fitted to.
+    # Points with |residual| > clip * sigma_i * sqrt(chi2_red) of their target are rejected and the fit
+    # repeated until nothing changes (at most max_iter times; clip=0 disables it). Errors are scaled by sqrt(chi2_red).
+    # Returns ({t0, e_t0, period, e_period, quad, e_quad, n, n_used, chi2}: arrays of length G, residuals, used mask).
+    group = np.asarray(group, dtype=int)
+    E, T, e_T = (np.asarray(a, dtype=float) for a in (E, T, e_T))
+    G, m = len(t0), degree + 1
+    t0, period, quad = (np.broadcast_to(np.asarray(a, dtype=float), (G,)) for a in (t0, period, quad))
+    # corrections to the initial ephemeris, with E scaled to [-1, 1] per target, keep the
+    # normal equations well conditioned for BJD-sized times and thousands of cycles
+    scale = np.ones(G); np.maximum.at(scale, group, np.abs(np.nan_to_num(E)))
+    X = (E / scale[group])[:, None] ** np.arange(m)
+    y = T - ephemeris_time(E, t0[group], period[group], quad[group])
+    valid = np.isfinite(y) & np.isfinite(e_T) & (e_T > 0)
+    w = np.where(valid, 1 / np.where(valid, e_T, 1)**2, 0.0)
+    X, y = np.where(valid[:, None], X, 0.0), np.where(valid, y, 0.0)
+    used = valid
+    for it in range(max_iter + 1):
+        wu = w * used
+        A = np.stack([np.bincount(group, wu * X[:, i] * X[:, j], G) for i in range(m) for j in range(m)], -1).reshape(G, m, m)
+        b = np.stack([np.bincount(group, wu * X[:, i] * y, G) for i in range(m)], -1)
+        n_used = np.bincount(group, used, G).astype(int)
+        ok = n_used >= m
+        A[~ok] = np.eye(m)
+        coef = np.linalg.solve(A, b[..., None])[..., 0]
+        resid = y - np.einsum('ij,ij->i', X, coef[group])
+        dof = n_used - m
+        chi2 = np.where(dof > 0, np.bincount(group, wu * resid**2, G) / np.maximum(dof, 1), np.nan)
+        if not clip or it == max_iter: break
+        keep = valid & ((np.abs(resid) * np.sqrt(w) <= clip * np.sqrt(chi2[group])) | np.isnan(chi2[group]))
+        if np.array_equal(keep, used): break
+        used = keep
+    err = np.sqrt(np.diagonal(np.linalg.inv(A), axis1=1, axis2=2) * chi2[:, None])
+    # terms a linear fit does not have: no correction, no error
+    c = np.zeros((G, 3)); c[:, :m] = coef; e = np.full((G, 3), np.nan); e[:, :m] = err
+    c[~ok], e[~ok] = np.nan, np.nan
+    fit = {'t0': t0 + c[:, 0], 'e_t0': e[:, 0], 'period': period + c[:, 1] / scale, 'e_period': e[:, 1] / scale,
+           'quad': quad + c[:, 2] / scale**2, 'e_quad': e[:, 2] / scale**2,
+           'n': np.bincount(group, valid, G).astype(int), 'n_used': n_used, 'chi2': chi2}
+    return fit, np.where(valid, resid, np.nan), used
+
+def event_rows(target, events):
+    # Rows in the mist_db query format from the events of an AnalysisWorker run
+    return [{'target': target, 'min_id': ev['ID'], 'kind': ev['ID'].rsplit('_', 1)[0], 'kvw': ev['KvW'], 'e_kvw': ev['e_KvW'],
+             'par': ev['Par'], 'e_par': ev['e_Par'], 'status': ev['Status']} for ev in events if ev is not None]
+
+def read_report(path):
+    # Rows in the mist_db query format from a Minima_Report.txt
+    rows, target = [], os.path.basename(os.path.dirname(os.path.abspath(path))).replace("_Detailed_Analysis", "")
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith("ANALYSIS REPORT:"): target = line.split(":", 1)[1].strip(); continue
+            cols = [c.strip() for c in line.split('|')]
+            if len(cols) < 4 or '+/-' not in cols[1] or cols[0] == 'ID': continue
+            (kvw, e_kvw), (par, e_par) = (map(float, c.split('+/-')) for c in cols[1:3])
+            rows.append({'target': target, 'min_id': cols[0], 'kind': cols[0].rsplit('_', 1)[0], 'kvw': kvw, 'e_kvw': e_kvw,
+                         'par': par, 'e_par': e_par, 'status': cols[3]})
+    return rows
+
+def window_offsets(windows):
+    # {label: phase offset} of (p_min, p_max, label) phase windows: the window centre in [0, 1)
+    return {lbl: ((p_min + p_max) / 2) % 1 for p_min, p_max, lbl in windows}
+
+def oc_tables(rows, ephemerides, method='kvw', clip=3.0, max_iter=10, offsets=None):
+    # (O-C rows, fit rows) for all minima whose target has an initial ephemeris (t0, period[, quad]).
+    # offsets ({label: phase}) extend / override KIND_OFFSETS; minima of other labels are not fitted.
+    # OC is relative to the initial ephemeris, OC_lin / OC_quad to the fitted linear / quadratic one [days].
+    rows = [r for r in rows if r['target'] in ephemerides]
+    if not rows: return [], []
+    targets, group = np.unique([r['target'] for r in rows], return_inverse=True)
+    eph = np.array([(list(ephemerides[t]) + [0.0])[:3] for t in targets], dtype=float)
+    t0, period, quad = eph.T
+    T = np.array([r[method] for r in rows], dtype=float)
+    e_T = np.array([r['e_' + method] for r in rows], dtype=float)
+    offsets = dict(KIND_OFFSETS, **(offsets or {}))
+    offset = np.array([offsets.get(r['kind'], np.nan) for r in rows], dtype=float)
+    fitted = np.array([r['kind'] in offsets for r in rows])
+    E = cycle_numbers(T, t0[group], period[group], quad[group], offset)
+    oc = T - ephemeris_time(E, t0[group], period[group], quad[group])
+    fits = {d: fit_ephemerides(group, E, T, np.where(fitted, e_T, np.nan), t0, period, quad, d, clip, max_iter) for d in (1, 2)}
+    # O-C against each fitted ephemeris for every minimum, fitted or not
+    res = {d: T - ephemeris_time(E, *(fits[d][0][c][group] for c in ('t0', 'period', 'quad'))) for d in (1, 2)}
+    table = [dict(zip(OC_COLUMNS, (r['target'], r['min_id'], r['kind'], r['status'], e, t, s, o, r1, r2, int(u1), int(u2))))
+             for r, e, t, s, o, r1, r2, u1, u2 in zip(rows, E, T, e_T, oc, res[1], res[2], fits[1][2], fits[2][2])]
+    fit_rows = [{'target': str(tg), 'degree': d, **{c: fits[d][0][c][g].item() for c in FIT_COLUMNS[2:]}}
+                for g, tg in enumerate(targets) for d in (1, 2)]
+    return table, fit_rows
+
+def write_csv(path, rows, fields):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader(); writer.writerows(rows)
+
+def load_rows(source, status=None):
+    if os.path.isdir(source): source = os.path.join(source, "Minima_Report.txt")
+    if source.endswith(".txt"): rows = read_report(source)
+    else:
+        from mist_db import ResultsDB
+        with ResultsDB(source) as db: rows = db.query()
+    return [r for r in rows if status is None or r['status'] == status]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="mist-oc", description="O-C tables and ephemeris fits from M.I.S.T minima")
+    ap.add_argument("sources", nargs="+", help="results database, Minima_Report.txt or *_Detailed_Analysis folder")
+    ap.add_argument("--ephemeris", help="CSV with target,t0,period[,quad] initial ephemerides")
+    ap.add_argument("--t0", type=float, help="initial epoch for targets not in --ephemeris")
+    ap.add_argument("--period", type=float, help="initial period [days] for targets not in --ephemeris")
+    ap.add_argument("--quad", type=float, default=0.0, help="initial quadratic term")
+    ap.add_argument("--method", choices=("kvw", "par"), default="kvw", help="minimum times to use")
+    ap.add_argument("--status", choices=("OK", "CHECK"), help="only minima with this status")
+    ap.add_argument("--clip", type=float, default=3.0, help="sigma-clipping threshold (0 = off)")
+    ap.add_argument("--offset", action="append", default=[], metavar="LABEL=PHASE",
+                    help="cycle offset of another window label, e.g. Tertiary=0.25, so its minima are fitted too")
+    ap.add_argument("--out", default="OC_Table.csv", help="O-C table CSV")
+    ap.add_argument("--fits", default="OC_Ephemeris.csv", help="fitted ephemerides CSV")
+    args = ap.parse_args(argv)
+
+    rows = []
+    for source in args.sources:
+        if not os.path.exists(source): print(f"NO SUCH SOURCE: {source}", file=sys.stderr); return 2
+        rows += load_rows(source, args.status)
+    ephemerides = {}
+    if args.ephemeris:
+        with open(args.ephemeris, newline='', encoding='utf-8') as f:
+            for r in csv.DictReader(f): ephemerides[r['target']] = (float(r['t0']), float(r['period']), float(r.get('quad') or 0))
+    missing = sorted({r['target'] for r in rows} - set(ephemerides))
+    if args.period:
+        if args.t0 is None: ap.error("--period needs --t0")
+        ephemerides.update({t: (args.t0, args.period, args.quad) for t in missing}); missing = []
+    for t in missing: print(f"NO EPHEMERIS, SKIPPED: {t}", file=sys.stderr)
+
+    try: offsets = {lbl: float(ph) for lbl, ph in (o.split('=', 1) for o in args.offset)}
+    except ValueError: ap.error("--offset takes LABEL=PHASE")
+    table, fits = oc_tables(rows, ephemerides, args.method, args.clip, offsets=offsets)
+    write_csv(args.out, table, OC_COLUMNS); write_csv(args.fits, fits, FIT_COLUMNS)
+    for f in fits:
+        q = f" | Q = {f['quad']:.3e} +/- {f['e_quad']:.1e}" if f['degree'] == 2 else ""
+        print(f"{f['target']:<30} {f['degree']} | T0 = {f['t0']:.6f} +/- {f['e_t0']:.6f} | P = {f['period']:.9f} +/- {f['e_period']:.9f}"
+              f"{q} | {f['n_used']}/{f['n']} USED | CHI2 {f['chi2']:.2f}")
+    print(f"{len(table)} MINIMA OF {len({f['target'] for f in fits})} TARGETS WRITTEN: {args.out}, {args.fits}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# Figure rendering stage of the pipeline.
+# Figures are drawn on an Agg canvas (no pyplot, no GUI backend) by a background process pool,
+# so the analysis and its reports never wait on matplotlib. matplotlib is only imported by the
+# first figure, so importing this module (and mist_core) stays cheap.
+import os
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# none: no figures | check-only: PNG of the CHECK minima | png: PNG of all | png+eps: PNG + EPS of all
+PLOT_MODES = ('none', 'check-only', 'png', 'png+eps')
+
+class FigureTemplate:
+    # One light-curve/residual figure whose artists are refilled for every minimum
+    def __init__(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.fig = Figure(figsize=(8, 6), layout='tight')
+        FigureCanvasAgg(self.fig)
+        self.ax1, self.ax2 = self.fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+        ax1, ax2 = self.ax1, self.ax2
+
+        # LIGHT CURVE & FIT
+        self.obs, = ax1.plot([], [], 'ko', alpha=0.7, label='Obs')
+        self.fit, = ax1.plot([], [], 'r-', lw=2, label='Fit')
+        self.t_min = ax1.axvline(0, color='blue', ls='--', alpha=0.5)
+        self.title = ax1.set_title("", color='black', fontsize=12)
+        ax1.set_ylabel("Magnitude / Flux")
+        ax1.invert_yaxis()
+        ax1.legend()
+        ax1.grid(True, linestyle=':', alpha=0.3)
+
+        # Residuals
+        self.res, = ax2.plot([], [], 'o', color='black', ms=math.sqrt(10), mew=0)
+        ax2.axhline(0, c='red', ls='--')
+        ax2.set_ylabel("Res.")
+        ax2.set_xlabel("BJD (Time)")
+        ax2.grid(True, linestyle=':', alpha=0.3)
+
+    def draw(self, x, y, fx, fy, tm, title, res):
+        self.obs.set_data(x, y)
+        self.fit.set_data(fx, fy)
+        self.t_min.set_xdata([tm, tm]); self.t_min.set_visible(not math.isnan(tm))
+        self.title.set_text(f"{title} (Minima Analysis)")
+        self.res.set_data(x, res)
+        for ax in (self.ax1, self.ax2):
+            ax.relim(visible_only=True); ax.autoscale_view()
+
+_TEMPLATE = None
+
+def render_event(x, y, fx, fy, tm, title, res, folder, eps_folder=None):
+    # Writes <folder>/<title>.png (and <eps_folder>/<title>.eps); reuses this process's template.
+    # Returns the seconds spent drawing and saving.
+    global _TEMPLATE
+    t0 = time.perf_counter()
+    if _TEMPLATE is None: _TEMPLATE = FigureTemplate()
+    _TEMPLATE.draw(x, y, fx, fy, tm, title, res)
+    _TEMPLATE.fig.savefig(os.path.join(folder, f"{title}.png"), dpi=150)
+    if eps_folder: _TEMPLATE.fig.savefig(os.path.join(eps_folder, f"{title}.eps"), format='eps')
+    return time.perf_counter() - t0
+
+class PlotRenderer:
+    # Collects the figures requested by the plot mode and renders them in the background
+    def __init__(self, mode, folder, eps_folder, workers=1):
+        if mode not in PLOT_MODES: raise ValueError(f"unknown plot mode '{mode}' (expected one of {', '.join(PLOT_MODES)})")
+        self.mode = mode
+        self.folder = folder
+        self.eps_folder = eps_folder if mode == 'png+eps' else None
+        if self.eps_folder: os.makedirs(self.eps_folder, exist_ok=True)
+        self.pool = ProcessPoolExecutor(max_workers=workers) if mode != 'none' else None
+        self.futures = {}
+        self.seconds = 0.0
+
+    def wants(self, ev):
+        return self.mode in ('png', 'png+eps') or (self.mode == 'check-only' and ev['Status'] == "CHECK")
+
+    def submit(self, ev):
+        if self.pool is None or not self.wants(ev): return
+        x, y, fx, fy, res = ev['plot']
+        fut = self.pool.submit(render_event, x, y, fx, fy, ev['KvW'], ev['ID'], res, self.folder, self.eps_folder)
+        self.futures[fut] = ev['ID']
+
+    def wait(self, on_done=None):
+        # Blocks until every submitted figure is written; returns {ID: error message} for failures
+        errors = {}
+        for done, fut in enumerate(as_completed(self.futures), 1):
+            try: self.seconds += fut.result()
+            except Exception as e: errors[self.futures[fut]] = str(e)
+            if on_done: on_done(done, len(self.futures))
+        return errors
+
+    def close(self):
+        if self.pool is not None: self.pool.shutdown(cancel_futures=True)
@@ -0,0 +1,95 @@
+# Incremental analysis state of one output folder, for observation files that grow between runs.
+# The parsed rows up to the last complete line are kept with the byte offset they end at and a hash of
+# every byte before it, so a rerun only parses what was appended to an unchanged file; finalized events are kept with the content key of their segment,
+# so only new or changed segments are fitted and drawn again.
+import os
+import json
+import hashlib
+import warnings
+import numpy as np
+from mist_cache import ResultCache
+
+STATE_VERSION = 4
+# params that change how a run executes but not its results
+RUNTIME_KEYS = ('filepath', 'workers', 'render_workers', 'trace', 'cache', 'result_cache', 'result_cache_mb',
+                'chunk_rows', 'stream', 'incremental')
+EVENT_KEYS = ('ID', 'KvW', 'e_KvW', 'Par', 'e_Par', 'N', 'MC_N', 'Status')
+
+def _prefix_hash(f, offset, block=1 << 20):
+    # SHA-1 object of the first offset bytes of the open file f, read in blocks
+    h = hashlib.sha1(); f.seek(0)
+    while offset > 0:
+        chunk = f.read(min(block, offset))
+        if not chunk: break
+        h.update(chunk); offset -= len(chunk)
+    return h
+
+class RunState:
+    def __init__(self, out_dir, p):
+        self.json_path = os.path.join(out_dir, ".mist_state.json")
+        self.npy_path = os.path.join(out_dir, ".mist_state.npy")
+        self.signature = hashlib.sha1(repr(sorted((k, v) for k, v in p.items() if k not in RUNTIME_KEYS)).encode()).hexdigest()
+        self.p = p
+        self.state = {}
+        try:
+            with open(self.json_path, encoding='utf-8') as f: state = json.load(f)
+            if state.get('version') == STATE_VERSION and state.get('signature') == self.signature: self.state = state
+        except (OSError, ValueError): pass
+        self.rows, self.offset, self.prefix, self.keys = None, 0, None, []
+        # run seed of the saved events; an unseeded rerun reuses it so the reported seed reproduces them
+        self.seed = self.state.get('seed')
+
+    def observations(self, fpath, columns, delim, skip):
+        # (data, n_new): all rows of fpath, parsing only the bytes after the saved offset when every byte
+        # before it is unchanged, else the whole file. A final line without newline is used if it parses,
+        # and read again next time.
+        st, old = self.state, None
+        with open(fpath, 'rb') as f:
+            h = hashlib.sha1()
+            if st.get('columns') == columns and 0 < st.get('offset', 0) <= os.fstat(f.fileno()).st_size:
+                h = _prefix_hash(f, st['offset'])
+                try:
+                    if h.hexdigest() == st.get('prefix'): old = np.load(self.npy_path)
+                except (OSError, ValueError): old = None
+                if old is None: h = hashlib.sha1()
+            start = st['offset'] if old is not None else 0
+            f.seek(start); buf = f.read()
+        end = buf.rfind(b'\n') + 1
+        h.update(buf[:end])
+        lines = buf[:end].decode('utf-8', errors='replace').splitlines()
+        if start == 0: lines = lines[skip:]
+        new = self._parse(lines, delim, columns)
+        try: partial = self._parse([buf[end:].decode('utf-8', errors='replace')], delim, columns)
+        except ValueError: partial = new[:0]   # line still being written
+        self.rows = new if old is None else np.concatenate([old, new])
+        self.offset, self.prefix = start + end, h.hexdigest()
+        return np.concatenate([self.rows, partial]), len(new) + len(partial)
+
+    @staticmethod
+    def _parse(lines, delim, columns):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)   # nothing appended
+            return np.loadtxt(lines, delimiter=delim, usecols=tuple(range(columns)), ndmin=2).reshape(-1, columns)
+
+    def lookup(self, segments):
+        # {index: event or None (failed fit)} of the segments finalized by the previous run with the same data
+        self.keys = [ResultCache.key(x, y, min_id, self.p) for min_id, x, y in segments]
+        events = self.state.get('events', {})
+        known = {}
+        for k, ((min_id, _, _), key) in enumerate(zip(segments, self.keys)):
+            ev = events.get(min_id)
+            if ev is not None and ev['key'] == key:
+                known[k] = None if ev.get('failed') else dict(ev['event'], cached=True, timing={})
+        return known
+
+    def save(self, segments, events, seed=None):
+        state = {'version': STATE_VERSION, 'signature': self.signature, 'seed': seed, 'columns': self.rows.shape[1],
+                 'offset': self.offset, 'prefix': self.prefix,
+                 'events': {min_id: ({'key': key, 'failed': True} if ev is None else
+                                     {'key': key, 'event': {k: ev[k] for k in EVENT_KEYS}})
+                            for (min_id, _, _), key, ev in zip(segments, self.keys, events)}}
+        try:
+            np.save(self.npy_path + ".tmp.npy", self.rows); os.replace(self.npy_path + ".tmp.npy", self.npy_path)
+            with open(self.json_path + ".tmp", 'w', encoding='utf-8') as f: json.dump(state, f)
+            os.replace(self.json_path + ".tmp", self.json_path)
+        except OSError: pass